@@ -1,31 +1,50 @@
 # src/agents/__init__.py
 
 import os
+import time
 from typing import Literal, List, Dict
 
 from openai import OpenAI
 
+from src.profiling import profiled
+from src.prompting import COMPACT_PROMPTS, count_tokens, record_llm_call
+
 # 讀取環境變數中的 API key
 client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
 Role = Literal["system", "user", "assistant"]
 
+# 任何 agent 的 prompt 有改動時請一併更新，已儲存的結果會依此區分版本
+# v2：精簡 profile、濃縮上游輸出、token 上限、固定內容放前面
+# v2-full：CRM_COMPACT_PROMPTS=0 的非精簡模式；指示內容已跟 v1 不同，不能沿用 v1 的結果
+PROMPT_VERSION = "v2" if COMPACT_PROMPTS else "v2-full"
+
 
+@profiled(cat="llm")
 def call_llm(
     system_prompt: str,
     user_prompt: str,
     model: str = "gpt-4.1-mini",  # 現在有的模型
+    stage: str = "default",
 ) -> str:
     """
     統一封裝 LLM 呼叫邏輯，之後每個 agent 都呼叫這個函式。
+    stage 是 agent 名稱，用來分開統計各 agent 的 prompt token 數與延遲。
     """
     messages: List[Dict[str, str]] = [
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": user_prompt},
     ]
 
+    started = time.perf_counter()
     resp = client.chat.completions.create(
         model=model,
         messages=messages,
     )
+    record_llm_call(
+        stage,
+        count_tokens(system_prompt) + count_tokens(user_prompt),
+        (time.perf_counter() - started) * 1000.0,
+        resp.usage,
+    )
     return resp.choices[0].message.content
@@ -1,6 +1,8 @@
 # src/agents/campaign_designer.py
 
 from . import call_llm
+from src.profiling import profiled, span
+from src.prompting import compose_prompt, condense_output, format_profile
 from src.tools import query_customer_profile
 
 
@@ -15,6 +17,23 @@ SYSTEM_PROMPT = """
 請使用專業、務實、條理清楚的繁體中文回答。
 """
 
+INTRO = """
+你會收到一位電信客戶的資料，以及一份「流失原因說明」。
+請你基於這些資訊，為該客戶設計合適的挽留方案。
+"""
+
+INSTRUCTIONS = """
+請依照以下格式，設計 1~2 個主要挽留方案（用繁體中文回答）：
+
+1. 先用 1~2 句話說明：你設計挽留方案時的思考邏輯（例如：高價值客戶可以給較有吸引力的方案，但仍要控管成本）。
+2. 條列 1~2 個「挽留方案」（每個方案用「-」開頭，不要再用數字編號），每個方案請包含：
+   - 方案名稱
+   - 方案內容（例如：幾折、幾個月、是否有升級或贈送服務）
+   - 為什麼這個方案適合這位客戶（要跟流失原因說明有關）
+   - 成本與風險考量（簡短即可）
+3. 最後給業務或行銷同仁一段 2~3 句話的建議，說明在執行這些方案時，需要注意什麼（例如：勿過度承諾、觀察後續使用行為變化等）。
+"""
+
 
 def estimate_customer_value(profile: dict) -> str:
     """
@@ -37,6 +56,7 @@ def estimate_customer_value(profile: dict) -> str:
         return "低價值"
 
 
+@profiled()
 def design_campaign(customer_id: str, churn_reasoning_result: dict) -> dict:
     """
     輸入：
@@ -53,36 +73,23 @@ def design_campaign(customer_id: str, churn_reasoning_result: dict) -> dict:
     """
     profile = query_customer_profile(customer_id)
     value_segment = estimate_customer_value(profile)
-    reasoning_text = churn_reasoning_result.get("reasoning", "")
-
-    user_prompt = f"""
-你會收到一位電信客戶的資料，以及一份「流失原因說明」。
-請你基於這些資訊，為該客戶設計合適的挽留方案。
-
-【客戶編號】
-{customer_id}
-
-【客戶價值分群】
-{value_segment} 客戶（依照月租費粗略判定）
-
-【客戶資料（欄位=值）】
-{profile}
-
-【流失原因說明】
-{reasoning_text}
-
-請依照以下格式，設計 1~2 個主要挽留方案（用繁體中文回答）：
-
-1. 先用 1~2 句話說明：你設計挽留方案時的思考邏輯（例如：高價值客戶可以給較有吸引力的方案，但仍要控管成本）。
-2. 條列 1~2 個「挽留方案」，每個方案請包含：
-   - 方案名稱
-   - 方案內容（例如：幾折、幾個月、是否有升級或贈送服務）
-   - 為什麼這個方案適合這位客戶（要跟上面的流失原因有關）
-   - 成本與風險考量（簡短即可）
-3. 最後給業務或行銷同仁一段 2~3 句話的建議，說明在執行這些方案時，需要注意什麼（例如：勿過度承諾、觀察後續使用行為變化等）。
-"""
-
-    campaign_text = call_llm(SYSTEM_PROMPT, user_prompt)
+    reasoning_text = condense_output(churn_reasoning_result.get("reasoning", ""), "reasoning")
+
+    with span("campaign_designer.build_prompt"):
+        user_prompt = compose_prompt(
+            "campaign_designer",
+            SYSTEM_PROMPT,
+            INTRO,
+            [
+                ("客戶編號", customer_id),
+                ("客戶價值分群", f"{value_segment} 客戶（依照月租費粗略判定）"),
+                ("客戶資料（欄位=值）", format_profile(profile)),
+            ],
+            INSTRUCTIONS,
+            upstream=("流失原因說明", reasoning_text),
+        )
+
+    campaign_text = call_llm(SYSTEM_PROMPT, user_prompt, stage="campaign_designer")
 
     return {
         "customer_id": customer_id,
@@ -1,7 +1,9 @@
 # src/agents/churn_reasoning.py
 
 from . import call_llm
-from src.tools import query_customer_profile
+from src.explain import format_drivers, get_churn_drivers
+from src.profiling import profiled, span
+from src.prompting import compose_prompt, condense_output
 
 
 SYSTEM_PROMPT = """
@@ -14,7 +16,20 @@ SYSTEM_PROMPT = """
 請使用專業但好理解的繁體中文，條列清楚。
 """
 
+INTRO = "你會收到一位客戶的主要流失影響因素與數據分析師的說明，請你幫忙進一步整理「流失原因」。"
 
+INSTRUCTIONS = """
+請你產生一份「流失原因說明」，包含：
+
+1. 用 2~3 句話總結這位客戶「可能會流失」的主要原因。
+2. 條列 3~5 個關鍵因素，說明這些因素如何提高流失風險（例如：合約即將到期、帳單金額偏高、tenure 太短、使用率可能下降、付款方式帶來不確定性等）。
+3. 簡短說明：如果這位客戶真的流失，對公司可能造成的影響（例如：高價值客戶流失、品牌評價、客服負擔等）。
+
+請用繁體中文回答，條列清楚，不要寫太學術。
+"""
+
+
+@profiled()
 def explain_churn_reason(customer_id: str, analyst_result: dict) -> dict:
     """
     輸入：
@@ -23,6 +38,7 @@ def explain_churn_reason(customer_id: str, analyst_result: dict) -> dict:
           期待至少包含：
             - "churn_probability": float
             - "analysis": str
+          若有 "drivers"（主要影響因素清單）會直接沿用，否則從分數表查詢
 
     輸出：
         {
@@ -30,35 +46,28 @@ def explain_churn_reason(customer_id: str, analyst_result: dict) -> dict:
             "reasoning": "自然語言說明..."
         }
     """
-    profile = query_customer_profile(customer_id)
+    drivers = analyst_result.get("drivers") or get_churn_drivers(customer_id)
     prob = analyst_result.get("churn_probability")
-    analyst_text = analyst_result.get("analysis", "")
-
-    user_prompt = f"""
-你會收到一位客戶的資料與數據分析師的說明，請你幫忙進一步整理「流失原因」。
-
-【客戶編號】
-{customer_id}
-
-【預測流失機率（0~1）】
-{prob:.3f}
-
-【客戶資料（欄位=值）】
-{profile}
-
-【數據分析師的說明】
-{analyst_text}
-
-請你產生一份「流失原因說明」，包含：
-
-1. 用 2~3 句話總結這位客戶「可能會流失」的主要原因。
-2. 條列 3~5 個關鍵因素，說明這些因素如何提高流失風險（例如：合約即將到期、帳單金額偏高、tenure 太短、使用率可能下降、付款方式帶來不確定性等）。
-3. 簡短說明：如果這位客戶真的流失，對公司可能造成的影響（例如：高價值客戶流失、品牌評價、客服負擔等）。
-
-請用繁體中文回答，條列清楚，不要寫太學術。
-"""
-
-    reasoning_text = call_llm(SYSTEM_PROMPT, user_prompt)
+    analyst_text = condense_output(analyst_result.get("analysis", ""), "analysis")
+
+    with span("churn_reasoning.build_prompt"):
+        user_prompt = compose_prompt(
+            "churn_reasoning",
+            SYSTEM_PROMPT,
+            INTRO,
+            [
+                ("客戶編號", customer_id),
+                ("預測流失機率（0~1）", f"{prob:.3f}"),
+                (
+                    "模型判斷的主要影響因素（特徵=值，括號內為 log-odds 貢獻度）",
+                    format_drivers(drivers),
+                ),
+            ],
+            INSTRUCTIONS,
+            upstream=("數據分析師的說明", analyst_text),
+        )
+
+    reasoning_text = call_llm(SYSTEM_PROMPT, user_prompt, stage="churn_reasoning")
 
     return {
         "customer_id": customer_id,
@@ -1,6 +1,8 @@
 # src/agents/communication.py
 
 from . import call_llm
+from src.profiling import profiled, span
+from src.prompting import compose_prompt, condense_output, format_profile
 from src.tools import query_customer_profile
 
 
@@ -15,41 +17,9 @@ SYSTEM_PROMPT = """
 請使用自然、禮貌、不浮誇的繁體中文，避免過度承諾。
 """
 
+INTRO = "你會收到一位電信客戶的基本資料與針對他的「挽留方案」說明，請你幫忙撰寫對外溝通內容。"
 
-def generate_communications(customer_id: str, campaign_result: dict) -> dict:
-    """
-    輸入：
-        - customer_id
-        - campaign_result: Campaign Designer Agent 的輸出 dict
-          預期包含：
-            - "campaign_plan": str
-            - "value_segment": str （高價值 / 中價值 / 低價值）
-
-    輸出：
-        {
-            "customer_id": ...,
-            "communications": "包含 Email / SMS / Call script 的文字"
-        }
-    """
-    profile = query_customer_profile(customer_id)
-    campaign_plan = campaign_result.get("campaign_plan", "")
-    value_segment = campaign_result.get("value_segment", "未分群")
-
-    user_prompt = f"""
-你會收到一位電信客戶的基本資料與針對他的「挽留方案」說明，請你幫忙撰寫對外溝通內容。
-
-【客戶編號】
-{customer_id}
-
-【客戶價值分群】
-{value_segment}
-
-【客戶資料（欄位=值）】
-{profile}
-
-【行銷挽留方案說明】
-{campaign_plan}
-
+INSTRUCTIONS = """
 請你用繁體中文，依照以下格式產出三種內容：
 
 一、Email 內容
@@ -68,7 +38,42 @@ def generate_communications(customer_id: str, campaign_result: dict) -> dict:
 請清楚區分三個部分，並使用適合商業溝通的語氣。
 """
 
-    text = call_llm(SYSTEM_PROMPT, user_prompt)
+
+@profiled()
+def generate_communications(customer_id: str, campaign_result: dict) -> dict:
+    """
+    輸入：
+        - customer_id
+        - campaign_result: Campaign Designer Agent 的輸出 dict
+          預期包含：
+            - "campaign_plan": str
+            - "value_segment": str （高價值 / 中價值 / 低價值）
+
+    輸出：
+        {
+            "customer_id": ...,
+            "communications": "包含 Email / SMS / Call script 的文字"
+        }
+    """
+    profile = query_customer_profile(customer_id)
+    campaign_plan = condense_output(campaign_result.get("campaign_plan", ""), "campaign")
+    value_segment = campaign_result.get("value_segment", "未分群")
+
+    with span("communication.build_prompt"):
+        user_prompt = compose_prompt(
+            "communication",
+            SYSTEM_PROMPT,
+            INTRO,
+            [
+                ("客戶編號", customer_id),
+                ("客戶價值分群", value_segment),
+                ("客戶資料（欄位=值）", format_profile(profile)),
+            ],
+            INSTRUCTIONS,
+            upstream=("行銷挽留方案說明", campaign_plan),
+        )
+
+    text = call_llm(SYSTEM_PROMPT, user_prompt, stage="communication")
 
     return {
         "customer_id": customer_id,
@@ -3,7 +3,7 @@
 
 import sys
 import os
-import re
+import uuid
 
 # 把專案根目錄加入 Python 路徑，讓 `import src.xxx` 可以正常運作
 ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
@@ -17,55 +17,24 @@ from src.tools import (
     list_customer_ids,
     query_customer_profile,
     get_random_customer_id,
+    risk_level,
 )
-from src.pipeline import run_full_pipeline
+from src import profiling
+from src.explain import top_risk_customer_ids
+from src.pipeline import USE_SIMILAR_CACHE, run_full_pipeline
+from src.prefetch import PREFETCH_TOP_N, USE_PREFETCH, PipelinePrefetcher, wait_attached
+from src.prompting import extract_numbered_section
+from src.result_store import get_result_store
+from src.similar_cache import get_similar_cache
 
 
-def risk_level(prob: float) -> str:
-    """根據機率給一個簡單的風險等級標籤"""
-    if prob >= 0.7:
-        return "高風險"
-    elif prob >= 0.4:
-        return "中風險"
-    else:
-        return "低風險"
-
-
-def extract_numbered_section(text: str, section_no: int = 1) -> str:
-    """
-    從 LLM 的輸出中抽出「第 N 點」的內容：
-    - 假設內容是這種格式：
-        1. xxx
-           xxx
-        2. yyy
-    - 我們會擷取從 `N.` 開頭那一行開始
-      一直到下一個 `數字.` 開頭的行之前。
-    """
-    if not text:
-        return ""
-
-    lines = text.splitlines()
-    start_prefix = f"{section_no}."
-    captured = []
-    capturing = False
-
-    for line in lines:
-        stripped = line.strip()
-        if not capturing:
-            if stripped.startswith(start_prefix):
-                capturing = True
-                captured.append(stripped)
-        else:
-            # 如果遇到新的「數字.」開頭，就代表下一段開始了
-            if re.match(r"^[0-9]+\.", stripped):
-                break
-            captured.append(stripped)
-
-    if not captured:
-        # 如果沒抓到，就退而求其次回傳全文
-        return text.strip()
-
-    return "\n".join(captured).strip()
+@st.cache_resource
+def get_prefetcher() -> PipelinePrefetcher:
+    """所有 session 共用一個 prefetcher；建立時先預先分析還沒有儲存結果的高風險客戶"""
+    prefetcher = PipelinePrefetcher(store=get_result_store())
+    if PREFETCH_TOP_N > 0:
+        prefetcher.prewarm(top_risk_customer_ids(PREFETCH_TOP_N))
+    return prefetcher
 
 
 def main():
@@ -136,24 +105,72 @@ def main():
     st.sidebar.markdown("---")
     st.sidebar.write("點擊下方按鈕執行完整 AI agents pipeline：")
 
+    force_refresh = st.sidebar.checkbox("忽略已儲存的結果，重新分析", value=False)
     run_button = st.sidebar.button("開始分析這位客戶")
 
-    # --- 主畫面內容 ---
-    if not run_button:
-        st.info("請在左側選擇客戶，並按下「開始分析這位客戶」。")
-        return
+    store = get_result_store()
+    with st.sidebar.expander("本週分析過的高風險客戶"):
+        high_risk = store.high_risk_this_week()
+        if high_risk:
+            st.dataframe(
+                pd.DataFrame(high_risk)[
+                    ["customer_id", "churn_probability", "value_segment", "created_at"]
+                ],
+                hide_index=True,
+            )
+        else:
+            st.write("本週尚無高風險客戶的分析結果。")
+
+    prefetcher = get_prefetcher() if USE_PREFETCH else None
+    if prefetcher is not None:
+        with st.sidebar.expander("背景預先分析（prefetch）統計"):
+            st.json(prefetcher.metrics())
 
     # 真正用來分析的 ID（一定是最新的）
     selected_id = st.session_state["selected_customer_id"]
 
-    # 執行 pipeline
-    with st.spinner("AI agents 正在分析中，請稍候..."):
-        try:
-            result = run_full_pipeline(selected_id)
-        except Exception as e:
-            st.error(f"執行 pipeline 時發生錯誤：{e}")
+    # --- 主畫面內容 ---
+    # 有已儲存的結果就直接載入，不必重跑所有 LLM 呼叫
+    result = None
+    if not (run_button and force_refresh):
+        result = store.load(selected_id)
+
+    if result is None:
+        if not run_button:
+            # 使用者還在看，先在背景開始分析這位客戶（換人時會取消上一位）
+            if prefetcher is not None:
+                if "prefetch_session_key" not in st.session_state:
+                    st.session_state["prefetch_session_key"] = uuid.uuid4().hex
+                prefetcher.select(selected_id, st.session_state["prefetch_session_key"])
+            st.info("請在左側選擇客戶，並按下「開始分析這位客戶」。")
             return
 
+        # 執行 pipeline（有 prefetch 時接上背景進行中或已完成的結果）
+        with st.spinner("AI agents 正在分析中，請稍候..."):
+            try:
+                if prefetcher is not None and not force_refresh:
+                    result = wait_attached(prefetcher.attach(selected_id))
+                else:
+                    result = run_full_pipeline(selected_id)
+            except Exception as e:
+                st.error(f"執行 pipeline 時發生錯誤：{e}")
+                return
+        store.save(result)
+        # 設 CRM_PROFILE=1 時，每次分析完就更新 trace 檔
+        profiling.write_trace()
+    else:
+        st.caption(f"已載入 {result['stored_at']}（UTC）儲存的分析結果。")
+
+    reused_from = result.get("reused_from")
+    if reused_from:
+        st.info(
+            f"流失原因與挽留方案沿用相似客戶 {reused_from['customer_id']} 的分析結果"
+            f"（標準化距離 {reused_from['distance']:.3f}）。"
+        )
+    if USE_SIMILAR_CACHE:
+        with st.sidebar.expander("相似客戶快取統計"):
+            st.json(get_similar_cache().metrics())
+
     # 1. 客戶總覽與流失風險
     st.subheader("1️⃣ 客戶總覽與流失風險")
 
@@ -195,6 +212,13 @@ def main():
         full_analyst = result["analyst"]["analysis"]
         analyst_section_1 = extract_numbered_section(full_analyst, section_no=1)
 
+        drivers = result["analyst"].get("drivers", [])
+        if drivers:
+            with st.expander("模型主要影響因素（特徵貢獻度）"):
+                df_drivers = pd.DataFrame(drivers)
+                df_drivers.columns = ["特徵", "值", "貢獻度（log-odds）"]
+                st.table(df_drivers)
+
         st.markdown("**Data Analyst Agent：流失風險評估**")
         st.write(analyst_section_1)
         with st.expander("查看完整分析內容（包含指標與建議）"):
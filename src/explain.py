@@ -0,0 +1,216 @@
+# src/explain.py
+
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from src.profiling import profiled
+from src.tools import _load_churn_df, _load_churn_model, _load_feature_cols
+
+
+# 每位客戶預先算好、要給 agents 看的主要影響因素數量
+DEFAULT_TOP_K = 5
+
+
+def compute_contributions(
+    X: np.ndarray,
+    coef: np.ndarray,
+    baseline: np.ndarray,
+) -> np.ndarray:
+    """
+    線性模型的特徵貢獻度：coef × (x - baseline)，單位是 log-odds。
+
+    X 是 (n_customers, n_features) 的矩陣，一次用 NumPy broadcasting 算完，
+    不需要逐筆客戶跑迴圈。正值代表把流失機率往上推，負值代表往下拉。
+    """
+    return (X - baseline) * coef
+
+
+def top_k_indices(contributions: np.ndarray, k: int) -> np.ndarray:
+    """
+    對每一列（每位客戶）找出 |貢獻度| 最大的 k 個特徵欄位 index，
+    依影響程度由大到小排序。回傳 shape = (n_customers, k)。
+    """
+    k = min(k, contributions.shape[1])
+    magnitude = np.abs(contributions)
+    # argpartition 先挑出前 k 名（O(n)），再只對這 k 個排序
+    part = np.argpartition(-magnitude, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(magnitude, part, axis=1), axis=1)
+    return np.take_along_axis(part, order, axis=1)
+
+
+class ExplanationTable:
+    """
+    整個客戶矩陣的流失分數 + 特徵貢獻度快取。
+
+    - 建立時一次算完所有客戶的 predict_proba 與貢獻度
+    - 每位客戶只保留前 top_k 個主要影響因素（index + 貢獻值），
+      跟分數放在一起，agents 查詢時直接取用
+    - baseline 使用全體客戶的特徵平均值（代表「一般客戶」）
+    """
+
+    def __init__(
+        self,
+        customer_ids: Iterable[str],
+        X: pd.DataFrame,
+        model,
+        top_k: int = DEFAULT_TOP_K,
+    ):
+        if not hasattr(model, "coef_"):
+            raise TypeError(
+                "目前的特徵貢獻度計算只支援線性模型（需要 coef_），"
+                f"收到的是 {type(model).__name__}"
+            )
+
+        self.model = model
+        self.top_k = top_k
+        self.feature_cols: List[str] = list(X.columns)
+        self.coef = np.asarray(model.coef_, dtype=float).ravel()
+
+        self.customer_ids: List[str] = list(customer_ids)
+        self.row_of: Dict[str, int] = {
+            cid: i for i, cid in enumerate(self.customer_ids)
+        }
+
+        self.X = X.to_numpy(dtype=float)
+        self.baseline = self.X.mean(axis=0)
+        self.scores = model.predict_proba(X)[:, 1].astype(float)
+
+        contributions = compute_contributions(self.X, self.coef, self.baseline)
+        self.top_idx = top_k_indices(contributions, top_k)
+        self.top_val = np.take_along_axis(contributions, self.top_idx, axis=1)
+
+    def update_rows(self, customer_ids: List[str], X: pd.DataFrame) -> np.ndarray:
+        """
+        只重新計算指定客戶的分數與主要影響因素（新客戶會附加在最後），
+        回傳更新後的流失機率。baseline 維持建表時的全體平均，不重算。
+        """
+        X_new = X[self.feature_cols].to_numpy(dtype=float)
+        scores = self.model.predict_proba(X[self.feature_cols])[:, 1].astype(float)
+        contributions = compute_contributions(X_new, self.coef, self.baseline)
+        top_idx = top_k_indices(contributions, self.top_k)
+        top_val = np.take_along_axis(contributions, top_idx, axis=1)
+
+        new_ids = [cid for cid in customer_ids if cid not in self.row_of]
+        if new_ids:
+            n_old = len(self.customer_ids)
+            n_new = len(new_ids)
+            self.X = np.vstack([self.X, np.zeros((n_new, self.X.shape[1]))])
+            self.scores = np.concatenate([self.scores, np.zeros(n_new)])
+            self.top_idx = np.vstack(
+                [self.top_idx, np.zeros((n_new, top_idx.shape[1]), dtype=top_idx.dtype)]
+            )
+            self.top_val = np.vstack(
+                [self.top_val, np.zeros((n_new, top_val.shape[1]))]
+            )
+            for i, cid in enumerate(new_ids):
+                self.row_of[cid] = n_old + i
+            self.customer_ids.extend(new_ids)
+
+        rows = np.asarray([self.row_of[cid] for cid in customer_ids], dtype=np.intp)
+        self.X[rows] = X_new
+        self.scores[rows] = scores
+        self.top_idx[rows] = top_idx
+        self.top_val[rows] = top_val
+        return scores
+
+    def _row(self, customer_id: str) -> int:
+        row = self.row_of.get(customer_id)
+        if row is None:
+            raise ValueError(f"找不到 customerID={customer_id} 的客戶")
+        return row
+
+    def score(self, customer_id: str) -> float:
+        """回傳快取中的流失機率"""
+        return float(self.scores[self._row(customer_id)])
+
+    def drivers(self, customer_id: str) -> List[Dict]:
+        """
+        回傳某位客戶的主要影響因素（依 |貢獻度| 由大到小），例如：
+        [
+            {"feature": "Contract_Month-to-month", "value": 1.0, "contribution": 0.412},
+            ...
+        ]
+        """
+        row = self._row(customer_id)
+        return [
+            {
+                "feature": self.feature_cols[j],
+                "value": float(self.X[row, j]),
+                "contribution": float(c),
+            }
+            for j, c in zip(self.top_idx[row], self.top_val[row])
+        ]
+
+
+@lru_cache(maxsize=1)
+@profiled()
+def _load_explanation_table() -> ExplanationTable:
+    """載入 churn model 並一次算好全部客戶的分數與主要影響因素"""
+    df = _load_churn_df()
+    feature_cols = _load_feature_cols()
+    model = _load_churn_model()
+    return ExplanationTable(df["customerID"], df[feature_cols], model)
+
+
+def get_churn_score(customer_id: str) -> float:
+    """從快取的分數表取流失機率（與 predict_churn 結果一致）"""
+    return _load_explanation_table().score(customer_id)
+
+
+def get_churn_drivers(customer_id: str) -> List[Dict]:
+    """取某位客戶預先算好的主要影響因素清單"""
+    return _load_explanation_table().drivers(customer_id)
+
+
+def top_risk_customer_ids(n: int) -> List[str]:
+    """流失機率最高的前 n 位客戶"""
+    table = _load_explanation_table()
+    n = min(n, len(table.customer_ids))
+    if n <= 0:
+        return []
+    top = np.argpartition(-table.scores, n - 1)[:n]
+    top = top[np.argsort(-table.scores[top])]
+    return [table.customer_ids[i] for i in top]
+
+
+def format_drivers(drivers: List[Dict], precision: int = 3) -> str:
+    """
+    把主要影響因素整理成精簡的文字清單，給 LLM prompt 使用：
+
+        - Contract_Month-to-month=1 （+0.412，提高流失風險）
+        - tenure=2 （+0.388，提高流失風險）
+    """
+    lines: List[str] = []
+    for d in drivers:
+        value = d["value"]
+        value_text = f"{value:g}" if value == int(value) else f"{value:.2f}"
+        direction = "提高流失風險" if d["contribution"] > 0 else "降低流失風險"
+        lines.append(
+            f"- {d['feature']}={value_text} "
+            f"（{d['contribution']:+.{precision}f}，{direction}）"
+        )
+    return "\n".join(lines)
+
+
+def explain_customer(customer_id: str, top_k: Optional[int] = None) -> Dict:
+    """
+    回傳某位客戶的分數 + 主要影響因素，例如：
+    {
+        "customer_id": "...",
+        "churn_probability": 0.83,
+        "drivers": [...],
+        "drivers_text": "- Contract_Month-to-month=1 （+0.412，提高流失風險）\\n..."
+    }
+    """
+    drivers = get_churn_drivers(customer_id)
+    if top_k is not None:
+        drivers = drivers[:top_k]
+    return {
+        "customer_id": customer_id,
+        "churn_probability": get_churn_score(customer_id),
+        "drivers": drivers,
+        "drivers_text": format_drivers(drivers),
+    }
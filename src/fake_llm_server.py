@@ -0,0 +1,143 @@
+# src/fake_llm_server.py
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Tuple
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8766
+
+# 模擬 agent 的輸出格式（Dashboard 會擷取「1.」那一段當摘要）
+FAKE_COMPLETION = """1. 這是本機假 LLM 服務產生的測試內容，用於壓力測試。
+2. 關鍵觀察：
+   - 合約型態與月租費為主要影響因素
+   - 建議持續觀察使用行為變化
+3. 建議：請業務與客服同仁依照實際情況調整。"""
+
+
+class FakeLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # listen backlog；預設 5 在壓測大量同時連線時會讓 SYN 被丟掉、等重送，量到的延遲尾端會失真
+    request_queue_size = 1024
+    latency_ms: float = 800.0
+    jitter_ms: float = 200.0
+    # 模擬 prefill：prompt 每 1000 個 token 額外增加的延遲
+    ms_per_1k_prompt_tokens: float = 0.0
+    requests: int = 0
+
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    """
+    相容 OpenAI Chat Completions API 的假服務：
+    POST /v1/chat/completions -> 等待 latency ± jitter 毫秒後回傳固定內容。
+    """
+
+    server: FakeLLMServer
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_error(404)
+            return
+
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        prompt_chars = sum(len(m.get("content", "")) for m in payload.get("messages", []))
+        # 粗估：中英混合文字約 2 個字元一個 token
+        prompt_tokens = prompt_chars // 2
+
+        delay = (
+            self.server.latency_ms
+            + random.uniform(-self.server.jitter_ms, self.server.jitter_ms)
+            + prompt_tokens / 1000.0 * self.server.ms_per_1k_prompt_tokens
+        )
+        time.sleep(max(delay, 0.0) / 1000.0)
+        self.server.requests += 1
+
+        body = json.dumps(
+            {
+                "id": f"chatcmpl-fake-{self.server.requests}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": payload.get("model", "fake"),
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": FAKE_COMPLETION},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": len(FAKE_COMPLETION) // 2,
+                    "total_tokens": prompt_tokens + len(FAKE_COMPLETION) // 2,
+                },
+            },
+            ensure_ascii=False,
+        ).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_fake_llm_server(
+    host: str = DEFAULT_HOST,
+    port: int = 0,
+    latency_ms: float = 800.0,
+    jitter_ms: float = 200.0,
+    ms_per_1k_prompt_tokens: float = 0.0,
+) -> Tuple[FakeLLMServer, str]:
+    """
+    在背景 thread 啟動假 LLM 服務（port=0 代表自動挑一個空的 port），
+    回傳 (server, base_url)，base_url 可直接設給 OPENAI_BASE_URL。
+    """
+    server = FakeLLMServer((host, port), FakeLLMHandler)
+    server.latency_ms = latency_ms
+    server.jitter_ms = jitter_ms
+    server.ms_per_1k_prompt_tokens = ms_per_1k_prompt_tokens
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本機假 LLM 服務（OpenAI 相容）")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--latency-ms", type=float, default=800.0)
+    parser.add_argument("--jitter-ms", type=float, default=200.0)
+    parser.add_argument(
+        "--ms-per-1k-prompt-tokens",
+        type=float,
+        default=0.0,
+        help="prompt 每 1000 個 token 額外增加的延遲（模擬 prefill）",
+    )
+    args = parser.parse_args()
+
+    server = FakeLLMServer((args.host, args.port), FakeLLMHandler)
+    server.latency_ms = args.latency_ms
+    server.jitter_ms = args.jitter_ms
+    server.ms_per_1k_prompt_tokens = args.ms_per_1k_prompt_tokens
+    print(
+        f"假 LLM 服務已啟動：http://{args.host}:{args.port}/v1"
+        f"（延遲 {args.latency_ms:.0f}±{args.jitter_ms:.0f}ms）"
+    )
+    print(f"使用方式：OPENAI_BASE_URL=http://{args.host}:{args.port}/v1 OPENAI_API_KEY=fake")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,479 @@
+# src/incremental_rescoring.py
+
+import argparse
+import csv
+import io
+import json
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from src.explain import _load_explanation_table
+from src.profiling import add_profiling_args, configure_from_args, profiled
+from src.tools import _load_churn_df, _load_feature_cols, _load_profiles_df, risk_level
+
+
+# 跟 data_prep.py 一致：這些欄位直接當數值特徵，其餘特徵是 One-Hot 展開的類別欄位
+NUMERIC_COLS = {"tenure", "MonthlyCharges", "TotalCharges", "SeniorCitizen"}
+
+# 異動紀錄中代表事件發生時間的欄位（ISO 8601 或 epoch 秒），用來量測延遲
+EVENT_TIME_FIELDS = ("event_time", "updated_at")
+
+
+class ChangeLogReader:
+    """
+    讀取 append-only 的客戶異動紀錄（JSONL 或 CSV）。
+
+    每次 poll() 從上次讀到的位置往後讀，只處理完整的行，
+    寫到一半的最後一行會留到下次再讀。CSV 第一行必須是欄位名稱。
+    無法解析的行不會中斷讀取，會放進 invalid_lines 等呼叫端處理。
+    指定 until 時最多只讀到該位置（用來把重播與新異動分成兩批）。
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.is_csv = self.path.suffix.lower() == ".csv"
+        self.offset = 0
+        self._header: Optional[List[str]] = None
+        self.invalid_lines: List[str] = []
+
+    def poll(self, until: Optional[int] = None) -> List[Dict]:
+        if not self.path.exists():
+            return []
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+            data = f.read() if until is None else f.read(max(until - self.offset, 0))
+
+        end = data.rfind(b"\n") + 1
+        if end == 0:
+            return []
+        self.offset += end
+        lines = data[:end].decode("utf-8").splitlines()
+
+        if not self.is_csv:
+            records = []
+            for line in lines:
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    record = None
+                if isinstance(record, dict):
+                    records.append(record)
+                else:
+                    self.invalid_lines.append(line)
+            return records
+
+        rows = list(csv.reader(io.StringIO("\n".join(lines))))
+        if self._header is None and rows:
+            self._header, rows = rows[0], rows[1:]
+        return [dict(zip(self._header, row)) for row in rows if row]
+
+
+def _parse_event_time(record: Dict) -> Optional[float]:
+    for field in EVENT_TIME_FIELDS:
+        value = record.get(field)
+        if value in (None, ""):
+            continue
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            pass
+        try:
+            ts = datetime.fromisoformat(str(value))
+        except ValueError:
+            return None
+        if ts.tzinfo is None:
+            ts = ts.replace(tzinfo=timezone.utc)
+        return ts.timestamp()
+    return None
+
+
+class FeatureEncoder:
+    """
+    用訓練時的特徵欄位（feature_columns.json）把原始客戶欄位轉成模型輸入。
+    只處理傳進來的那幾列，結果與 pd.get_dummies 的欄位與順序一致；
+    訓練時沒看過的類別值，對應的 One-Hot 欄位全部為 0。
+    """
+
+    def __init__(self, feature_cols: List[str]):
+        self.feature_cols = feature_cols
+        self.numeric: List[str] = []
+        self.categorical: List[Tuple[str, str, str]] = []  # (特徵欄位, 原始欄位, 值)
+        for col in feature_cols:
+            if col in NUMERIC_COLS:
+                self.numeric.append(col)
+            else:
+                source, _, value = col.partition("_")
+                self.categorical.append((col, source, value))
+        # 編碼需要的原始欄位；新客戶的異動必須全部提供
+        self.source_columns = set(self.numeric) | {source for _, source, _ in self.categorical}
+
+    def encode(self, profiles: pd.DataFrame) -> pd.DataFrame:
+        encoded = pd.DataFrame(index=profiles.index)
+        for col in self.numeric:
+            encoded[col] = pd.to_numeric(profiles[col], errors="coerce").astype(float)
+        for col, source, value in self.categorical:
+            encoded[col] = (profiles[source].astype(str) == value).astype(float)
+        return encoded[self.feature_cols]
+
+
+class IncrementalRescorer:
+    """
+    事件驅動的增量重新評分：
+
+    1. 把異動套用到記憶體中的客戶資料（_load_profiles_df / _load_churn_df 的快取）
+    2. 只針對有異動的客戶，用訓練時的特徵欄位重新編碼
+    3. 只重新評分這些客戶，並更新分數表（explain.py 的 ExplanationTable）
+    4. 風險等級跨過門檻的客戶放進 pending，等待重新跑 agents pipeline
+    """
+
+    def __init__(self):
+        self.profiles = _load_profiles_df()
+        self.churn_df = _load_churn_df()
+        self.feature_cols = _load_feature_cols()
+        self.encoder = FeatureEncoder(self.feature_cols)
+        self.table = _load_explanation_table()
+
+        # 整數欄位（例如 tenure）寫入小數會觸發 pandas 的型別錯誤或警告，
+        # 而且可能發生在寫到一半時；先統一轉成 float，之後的寫入就不會改變欄位型別
+        for df, cols in ((self.profiles, self.profiles.columns), (self.churn_df, self.feature_cols)):
+            for col in NUMERIC_COLS.intersection(cols):
+                if df[col].dtype.kind in "iu":
+                    df[col] = df[col].astype(float)
+
+        self._profile_row: Dict[str, int] = {
+            cid: i for cid, i in zip(self.profiles["customerID"], self.profiles.index)
+        }
+        self._feature_row: Dict[str, int] = {
+            cid: i for cid, i in zip(self.churn_df["customerID"], self.churn_df.index)
+        }
+        self.pending: List[Dict] = []
+
+    def _clean_fields(self, record: Dict, profile_cols: set) -> Tuple[Dict, Optional[str]]:
+        """取出異動的客戶欄位並轉型；空白視為沒有異動，數值欄位無法轉成有限的數字時回傳錯誤"""
+        fields = {}
+        for col, value in record.items():
+            if col not in profile_cols or value is None:
+                continue
+            if isinstance(value, str):
+                value = value.strip()
+                if value == "":
+                    continue
+            if col in NUMERIC_COLS:
+                number = pd.to_numeric(value, errors="coerce")
+                if pd.isna(number) or not np.isfinite(number):
+                    return {}, f"{col}={value!r} 不是有限的數值"
+                value = number
+            fields[col] = value
+        return fields, None
+
+    def _upsert_profile(self, customer_id: str, fields: Dict) -> None:
+        row = self._profile_row.get(customer_id)
+        if row is None:
+            row = self.profiles.index.max() + 1 if len(self.profiles) else 0
+            self.profiles.loc[row, "customerID"] = customer_id
+            self._profile_row[customer_id] = row
+        for col, value in fields.items():
+            self.profiles.loc[row, col] = value
+
+    def _write_features(self, customer_ids: List[str], encoded: pd.DataFrame) -> None:
+        dtypes = self.churn_df[self.feature_cols].dtypes
+        for cid, values in zip(customer_ids, encoded.itertuples(index=False)):
+            values = [
+                dtype.type(v) if dtype.kind == "b" else v
+                for v, dtype in zip(values, dtypes)
+            ]
+            row = self._feature_row.get(cid)
+            if row is None:
+                # 新客戶沒有 ChurnLabel（尚未知道是否流失），該欄位留空
+                row = self.churn_df.index.max() + 1 if len(self.churn_df) else 0
+                self.churn_df.loc[row, ["customerID", *self.feature_cols]] = [cid, *values]
+                self._feature_row[cid] = row
+            else:
+                self.churn_df.loc[row, self.feature_cols] = values
+
+    @profiled()
+    def apply(self, records: List[Dict]) -> Dict:
+        """
+        套用一批異動並重新評分，回傳統計：
+        {
+            "changed": 筆數,
+            "flagged": [{"customer_id", "old_probability", "new_probability",
+                         "old_risk_level", "new_risk_level"}, ...],
+            "rejected": [{"customer_id", "record", "reason"}, ...],
+            "processing_ms": 這批處理時間,
+            "lag_ms": [每筆異動從 event_time 到評分完成的延遲]
+        }
+
+        所有異動先在副本上驗證、編碼並評分，成功後才寫回記憶體中的資料；
+        無法轉型或非有限的數值、缺少必要欄位的新客戶、編碼後仍有空值的客戶都會放進 rejected，
+        不影響同一批的其他客戶。
+        """
+        started = time.perf_counter()
+        profile_cols = set(self.profiles.columns) - {"customerID"}
+        rejected: List[Dict] = []
+
+        # 同一位客戶在同一批有多筆異動時，依序合併
+        changes: Dict[str, Dict] = {}
+        sources: Dict[str, List[Dict]] = {}
+        event_times: Dict[str, float] = {}
+        for record in records:
+            customer_id = str(record.get("customerID", "")).strip()
+            if not customer_id:
+                rejected.append({"customer_id": None, "record": record, "reason": "缺少 customerID"})
+                continue
+            fields, error = self._clean_fields(record, profile_cols)
+            if error is not None:
+                rejected.append({"customer_id": customer_id, "record": record, "reason": error})
+                continue
+            changes.setdefault(customer_id, {}).update(fields)
+            sources.setdefault(customer_id, []).append(record)
+            event_time = _parse_event_time(record)
+            if event_time is not None:
+                event_times[customer_id] = min(
+                    event_times.get(customer_id, event_time), event_time
+                )
+
+        def reject(cid: str, reason: str) -> None:
+            changes.pop(cid, None)
+            event_times.pop(cid, None)
+            for record in sources.pop(cid, []):
+                rejected.append({"customer_id": cid, "record": record, "reason": reason})
+
+        # 在副本上套用異動：新客戶必須提供所有編碼需要的欄位
+        candidates: Dict[str, pd.Series] = {}
+        for cid, fields in list(changes.items()):
+            row = self._profile_row.get(cid)
+            if row is None:
+                missing = sorted(self.encoder.source_columns - fields.keys())
+                if missing:
+                    reject(cid, f"新客戶缺少欄位：{', '.join(missing)}")
+                    continue
+                base = pd.Series(index=self.profiles.columns, dtype=object)
+            else:
+                base = self.profiles.loc[row].astype(object)
+            for col, value in fields.items():
+                base[col] = value
+            candidates[cid] = base
+
+        if candidates:
+            encoded = self.encoder.encode(pd.DataFrame.from_dict(candidates, orient="index"))
+            invalid = ~np.isfinite(encoded.to_numpy(dtype=float)).all(axis=1)
+            for cid in encoded.index[invalid]:
+                reject(cid, "編碼後仍有空值或非有限值的特徵")
+            encoded = encoded.loc[list(changes)]
+
+        if not changes:
+            return {
+                "changed": 0,
+                "flagged": [],
+                "rejected": rejected,
+                "processing_ms": (time.perf_counter() - started) * 1000.0,
+                "lag_ms": [],
+            }
+
+        customer_ids = list(changes)
+        old_probs = {
+            cid: self.table.score(cid) for cid in customer_ids if cid in self.table.row_of
+        }
+
+        # 先評分：update_rows 在模型計算完成後才寫入分數表，評分失敗時整批都還沒寫入，
+        # 記憶體中的資料不會出現「特徵已更新、分數還是舊的」的狀態
+        new_probs = self.table.update_rows(customer_ids, encoded)
+        for cid, fields in changes.items():
+            self._upsert_profile(cid, fields)
+        self._write_features(customer_ids, encoded)
+        self._update_similar_cache(customer_ids, encoded)
+
+        flagged = []
+        for cid, new_prob in zip(customer_ids, new_probs):
+            old_prob = old_probs.get(cid)
+            old_level = risk_level(old_prob) if old_prob is not None else None
+            new_level = risk_level(float(new_prob))
+            if old_level != new_level:
+                flagged.append(
+                    {
+                        "customer_id": cid,
+                        "old_probability": old_prob,
+                        "new_probability": float(new_prob),
+                        "old_risk_level": old_level,
+                        "new_risk_level": new_level,
+                    }
+                )
+        self.pending.extend(flagged)
+
+        scored_at = time.time()
+        return {
+            "changed": len(customer_ids),
+            "flagged": flagged,
+            "rejected": rejected,
+            "processing_ms": (time.perf_counter() - started) * 1000.0,
+            "lag_ms": [(scored_at - t) * 1000.0 for t in event_times.values()],
+        }
+
+    def _update_similar_cache(self, customer_ids: List[str], encoded: pd.DataFrame) -> None:
+        # 相似客戶快取已經建立時，同步更新這些客戶的特徵向量；
+        # 還沒建立的話，之後建立時會直接讀到已更新的 _load_churn_df。
+        # 沒用到 pipeline 時不 import（result_store 會連帶載入 agents / LLM client）
+        similar_cache = sys.modules.get("src.similar_cache")
+        if similar_cache is not None and similar_cache.get_similar_cache.cache_info().currsize:
+            similar_cache.get_similar_cache().update_vectors(customer_ids, encoded)
+
+    def drain_pending(self) -> List[str]:
+        """取出等待重新跑 agents pipeline 的客戶 ID（不重複）"""
+        ids = list(dict.fromkeys(item["customer_id"] for item in self.pending))
+        self.pending = []
+        return ids
+
+
+def _format_lag(lag_ms: List[float]) -> str:
+    if not lag_ms:
+        return "無 event_time"
+    lag = np.asarray(lag_ms)
+    return (
+        f"p50={np.percentile(lag, 50):.1f}ms  p95={np.percentile(lag, 95):.1f}ms  "
+        f"max={lag.max():.1f}ms"
+    )
+
+
+def _write_rejected(path: Path, items: List[Dict]) -> None:
+    """無法套用的異動寫到 dead-letter 檔（JSONL），之後可以修正再重送"""
+    if not items:
+        return
+    with open(path, "a", encoding="utf-8") as f:
+        for item in items:
+            f.write(json.dumps(item, ensure_ascii=False, default=str) + "\n")
+
+
+def _load_pipeline_offset(state_file: Path, change_log: Path) -> int:
+    """讀取上次已跑完 pipeline 的異動紀錄位置；檔案被截短或換新時從頭開始"""
+    try:
+        offset = int(json.loads(state_file.read_text(encoding="utf-8"))["pipeline_offset"])
+    except (OSError, ValueError, KeyError, TypeError):
+        return 0
+    if not change_log.exists() or change_log.stat().st_size < offset:
+        return 0
+    return offset
+
+
+def _save_pipeline_offset(state_file: Path, offset: int) -> None:
+    tmp = state_file.with_name(state_file.name + ".tmp")
+    tmp.write_text(json.dumps({"pipeline_offset": offset}), encoding="utf-8")
+    tmp.replace(state_file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="依客戶異動紀錄增量重新評分")
+    parser.add_argument("change_log", type=Path, help="異動紀錄檔（.jsonl 或 .csv）")
+    parser.add_argument("--follow", action="store_true", help="持續監看檔案新增的異動")
+    parser.add_argument("--interval", type=float, default=1.0, help="--follow 的輪詢秒數")
+    parser.add_argument(
+        "--run-pipeline",
+        action="store_true",
+        help="風險等級改變的客戶直接重新跑 agents pipeline 並寫入結果儲存",
+    )
+    parser.add_argument(
+        "--rejected-log",
+        type=Path,
+        default=None,
+        help="無法套用的異動寫到這個檔案（預設為 <異動紀錄檔>.rejected.jsonl）",
+    )
+    parser.add_argument(
+        "--state-file",
+        type=Path,
+        default=None,
+        help="--run-pipeline 已處理到的位置記在這個檔案（預設為 <異動紀錄檔>.state.json）",
+    )
+    add_profiling_args(parser)
+    args = parser.parse_args()
+    configure_from_args(args)
+
+    rejected_log = args.rejected_log or args.change_log.with_name(
+        args.change_log.name + ".rejected.jsonl"
+    )
+    state_file = args.state_file or args.change_log.with_name(
+        args.change_log.name + ".state.json"
+    )
+    reader = ChangeLogReader(args.change_log)
+    rescorer = IncrementalRescorer()
+
+    # 異動只套用在記憶體中，重新啟動時仍要從頭重播才能還原分數；
+    # 但上次已經跑過 pipeline 的部分不再重跑 LLM，只處理之後的新異動
+    pipeline_offset = (
+        _load_pipeline_offset(state_file, args.change_log) if args.run_pipeline else 0
+    )
+    if pipeline_offset:
+        records = reader.poll(until=pipeline_offset)
+        # 這部分的無效異動上次已經寫進 dead-letter 檔
+        reader.invalid_lines = []
+        if records:
+            try:
+                rescorer.apply(records)
+            except Exception as e:
+                print(f"重播 {len(records)} 筆異動失敗：{e}")
+            rescorer.drain_pending()
+        print(f"重播 {len(records)} 筆已跑過 pipeline 的異動（不重新分析）")
+
+    while True:
+        records = reader.poll()
+        if reader.invalid_lines:
+            _write_rejected(
+                rejected_log,
+                [{"line": line, "reason": "無法解析的行"} for line in reader.invalid_lines],
+            )
+            print(f"略過 {len(reader.invalid_lines)} 行無法解析的異動，已寫入 {rejected_log}")
+            reader.invalid_lines = []
+
+        stats = None
+        if records:
+            try:
+                stats = rescorer.apply(records)
+            except Exception as e:
+                # 讀取位置已經往後移，整批寫進 dead-letter，避免遺失也不讓 --follow 中斷
+                _write_rejected(
+                    rejected_log,
+                    [{"record": r, "reason": f"{type(e).__name__}: {e}"} for r in records],
+                )
+                print(f"套用 {len(records)} 筆異動失敗：{e}（已寫入 {rejected_log}）")
+
+        if stats is not None:
+            if stats["rejected"]:
+                _write_rejected(rejected_log, stats["rejected"])
+                print(f"略過 {len(stats['rejected'])} 筆無效異動，已寫入 {rejected_log}")
+            print(
+                f"重新評分 {stats['changed']} 位客戶（{stats['processing_ms']:.1f}ms），"
+                f"延遲 {_format_lag(stats['lag_ms'])}"
+            )
+            for item in stats["flagged"]:
+                print(
+                    f"  {item['customer_id']}: {item['old_risk_level']} -> "
+                    f"{item['new_risk_level']}（{item['new_probability']:.3f}）"
+                )
+
+            if args.run_pipeline:
+                # 只有需要時才載入 agents（會初始化 LLM client）
+                from src.pipeline import run_batch_pipeline
+
+                flagged_ids = rescorer.drain_pending()
+                if flagged_ids:
+                    summary = run_batch_pipeline(flagged_ids, skip_stored=False)
+                    print(f"  已重新分析 {summary['processed']} 位客戶")
+
+        if args.run_pipeline and reader.offset > pipeline_offset:
+            pipeline_offset = reader.offset
+            _save_pipeline_offset(state_file, pipeline_offset)
+
+        if not args.follow:
+            break
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+# src/load_test_dashboard.py
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from src import profiling
+from src.fake_llm_server import start_fake_llm_server
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+ACTIONS = ("select", "random_pick", "analyze")
+
+
+def _current_rss_mb() -> Optional[float]:
+    """目前 process 的常駐記憶體（MB），僅 Linux 可用"""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _peak_rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 單位是 KB，macOS 是 bytes
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+class _Recorder:
+    """收集每個動作的延遲與錯誤（thread-safe）"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.error_samples: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def timed(self, action: str, fn: Callable, *args):
+        start = time.perf_counter()
+        try:
+            result = fn(*args)
+        except Exception as e:
+            with self._lock:
+                self.errors[action] += 1
+                self.error_samples.setdefault(action, f"{type(e).__name__}: {e}")
+            return None
+        with self._lock:
+            self.latencies[action].append(time.perf_counter() - start)
+        return result
+
+
+def _pipeline_session(recorder: _Recorder, iterations: int, seed: int) -> None:
+    """直接呼叫 Dashboard 背後的函式，模擬一位使用者：選客戶 → 隨機挑 → 分析"""
+    # agents 在 import 時就建立 LLM client，所以要等 OPENAI_BASE_URL 設好才 import
+    from src.pipeline import run_full_pipeline
+    from src.result_store import get_result_store
+    from src.tools import get_random_customer_id, list_customer_ids, query_customer_profile
+
+    rng = random.Random(seed)
+    store = get_result_store()
+
+    def select() -> str:
+        customer_id = rng.choice(list_customer_ids())
+        query_customer_profile(customer_id)
+        store.load(customer_id)
+        return customer_id
+
+    def random_pick() -> str:
+        customer_id = get_random_customer_id()
+        query_customer_profile(customer_id)
+        return customer_id
+
+    def analyze(customer_id: str) -> Dict:
+        result = store.load(customer_id)
+        if result is None:
+            result = run_full_pipeline(customer_id)
+            store.save(result)
+        return result
+
+    for _ in range(iterations):
+        recorder.timed("select", select)
+        customer_id = recorder.timed("random_pick", random_pick)
+        if customer_id is not None:
+            recorder.timed("analyze", analyze, customer_id)
+
+
+def _app_session(recorder: _Recorder, iterations: int, seed: int) -> None:
+    """用 Streamlit AppTest 執行 dashboard.py，模擬一位使用者在 UI 上的操作"""
+    from streamlit.testing.v1 import AppTest
+
+    rng = random.Random(seed)
+    app_path = str(Path(__file__).with_name("dashboard.py"))
+
+    def check(at) -> None:
+        if at.exception:
+            raise RuntimeError(at.exception[0].value)
+
+    at = AppTest.from_file(app_path, default_timeout=600)
+    recorder.timed("select", lambda: check(at.run()))
+
+    for _ in range(iterations):
+        def select():
+            box = at.sidebar.selectbox[0]
+            check(box.select(rng.choice(box.options)).run())
+
+        def random_pick():
+            check(at.sidebar.button[0].click().run())
+
+        def analyze():
+            button = next(b for b in at.sidebar.button if "開始分析" in b.label)
+            check(button.click().run())
+
+        recorder.timed("select", select)
+        recorder.timed("random_pick", random_pick)
+        recorder.timed("analyze", analyze)
+
+
+def warm_up() -> None:
+    """先載入資料、模型與分數表，避免第一輪的延遲與記憶體數字被一次性的載入成本灌水"""
+    from src.explain import explain_customer
+    from src.result_store import get_result_store
+    from src.tools import list_customer_ids
+
+    explain_customer(list_customer_ids()[0])
+    get_result_store()
+
+
+def run_load_test(
+    sessions: int,
+    iterations: int = 1,
+    mode: str = "pipeline",
+) -> Dict:
+    """同時跑 sessions 個模擬使用者，回傳延遲、吞吐量、錯誤率與記憶體統計"""
+    session_fn = _pipeline_session if mode == "pipeline" else _app_session
+    recorder = _Recorder()
+    rss_before = _current_rss_mb()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=sessions) as pool:
+        futures = [
+            pool.submit(session_fn, recorder, iterations, seed)
+            for seed in range(sessions)
+        ]
+        for future in futures:
+            future.result()
+    elapsed = time.perf_counter() - started
+    rss_after = _current_rss_mb()
+
+    report = {
+        "mode": mode,
+        "sessions": sessions,
+        "iterations": iterations,
+        "elapsed_s": elapsed,
+        "actions": {},
+        "rss_before_mb": rss_before,
+        "rss_after_mb": rss_after,
+        "peak_rss_mb": _peak_rss_mb(),
+        "error_samples": dict(recorder.error_samples),
+    }
+    if rss_before is not None and rss_after is not None:
+        report["memory_per_session_mb"] = (rss_after - rss_before) / sessions
+
+    for action in ACTIONS:
+        lat_ms = np.asarray(recorder.latencies.get(action, [])) * 1000.0
+        errors = recorder.errors.get(action, 0)
+        total = len(lat_ms) + errors
+        report["actions"][action] = {
+            "count": len(lat_ms),
+            "errors": errors,
+            "error_rate": errors / total if total else 0.0,
+            "throughput_per_s": len(lat_ms) / elapsed if elapsed else 0.0,
+            "p50_ms": float(np.percentile(lat_ms, 50)) if len(lat_ms) else None,
+            "p95_ms": float(np.percentile(lat_ms, 95)) if len(lat_ms) else None,
+            "p99_ms": float(np.percentile(lat_ms, 99)) if len(lat_ms) else None,
+        }
+    return report
+
+
+def _fmt(value: Optional[float], unit: str = "") -> str:
+    return "-" if value is None else f"{value:.1f}{unit}"
+
+
+def print_report(report: Dict, top_spans: int = 10) -> None:
+    print(
+        f"\n=== Load test：mode={report['mode']}  sessions={report['sessions']}  "
+        f"iterations={report['iterations']}  耗時 {report['elapsed_s']:.1f}s ==="
+    )
+    print(f"{'action':<12}{'count':>7}{'err%':>7}{'/s':>8}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for action, a in report["actions"].items():
+        print(
+            f"{action:<12}{a['count']:>7}{a['error_rate'] * 100:>6.1f}%"
+            f"{a['throughput_per_s']:>8.2f}{_fmt(a['p50_ms'], 'ms'):>10}"
+            f"{_fmt(a['p95_ms'], 'ms'):>10}{_fmt(a['p99_ms'], 'ms'):>10}"
+        )
+
+    print(
+        f"記憶體：開始 {_fmt(report['rss_before_mb'], 'MB')}，結束 {_fmt(report['rss_after_mb'], 'MB')}，"
+        f"峰值 {_fmt(report['peak_rss_mb'], 'MB')}，"
+        f"每個 session 約 {_fmt(report.get('memory_per_session_mb'), 'MB')}"
+    )
+    for action, sample in report["error_samples"].items():
+        print(f"錯誤範例（{action}）：{sample}")
+
+    # 各函式的耗時：平均耗時隨 sessions 增加而變長的地方，就是資源爭用點
+    spans = profiling.summarize_spans()
+    if spans:
+        print(f"\n耗時最多的函式（前 {top_spans} 名，依總耗時排序）：")
+        print(f"{'span':<55}{'count':>7}{'mean':>11}{'total':>12}")
+        ranked = sorted(spans.items(), key=lambda kv: kv[1]["total_ms"], reverse=True)
+        for name, s in ranked[:top_spans]:
+            print(
+                f"{name:<55}{s['count']:>7}{s['mean_ms']:>9.1f}ms{s['total_ms'] / 1000:>11.2f}s"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dashboard / pipeline 多人同時使用的壓力測試")
+    parser.add_argument(
+        "--sessions",
+        default="10",
+        help="同時模擬的使用者數；可用逗號一次跑多組，例如 1,10,50",
+    )
+    parser.add_argument("--iterations", type=int, default=2, help="每位使用者重複幾輪操作")
+    parser.add_argument(
+        "--mode",
+        choices=["pipeline", "app"],
+        default="pipeline",
+        help="pipeline：直接呼叫 pipeline 函式；app：用 Streamlit AppTest 跑 dashboard.py",
+    )
+    parser.add_argument("--llm-latency-ms", type=float, default=800.0)
+    parser.add_argument("--llm-jitter-ms", type=float, default=200.0)
+    parser.add_argument(
+        "--llm-base-url",
+        default=None,
+        help="使用已啟動的 LLM 服務（例如 python -m src.fake_llm_server）；未指定時自動啟動本機假服務",
+    )
+    args = parser.parse_args()
+
+    if args.llm_base_url:
+        base_url = args.llm_base_url
+    else:
+        _, base_url = start_fake_llm_server(
+            latency_ms=args.llm_latency_ms, jitter_ms=args.llm_jitter_ms
+        )
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ.setdefault("OPENAI_API_KEY", "fake")
+    # 每次壓測用全新的結果儲存，避免讀到之前的結果、也不污染正式資料
+    os.environ["CRM_RESULT_DB"] = str(
+        Path(tempfile.mkdtemp(prefix="crm-load-test-")) / "results.db"
+    )
+    print(f"LLM 服務：{base_url}")
+
+    # 記錄各函式耗時，找出爭用點
+    profiling.enable_profiling()
+    warm_up()
+
+    for sessions in [int(n) for n in args.sessions.split(",")]:
+        profiling.reset_spans()
+        report = run_load_test(sessions, args.iterations, args.mode)
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,33 @@
 # src/pipeline.py
 
-from typing import Dict
+import argparse
+import os
+from typing import Callable, Dict, List, Optional
 
 from src.agents.data_analyst import analyze_customer
 from src.agents.churn_reasoning import explain_churn_reason
-from src.agents.campaign_designer import design_campaign
+from src.agents.campaign_designer import design_campaign, estimate_customer_value
 from src.agents.communication import generate_communications
+from src.profiling import add_profiling_args, configure_from_args, profiled
+from src.result_store import ResultStore, get_result_store
+from src.similar_cache import get_similar_cache
+from src.tools import list_customer_ids, query_customer_profile
 
 
-def run_full_pipeline(customer_id: str) -> Dict:
+# 設 CRM_SIMILAR_CACHE=1 時，預設會沿用相似客戶的流失原因與挽留方案
+USE_SIMILAR_CACHE = os.getenv("CRM_SIMILAR_CACHE", "0") == "1"
+
+
+class PipelineCancelled(Exception):
+    """should_cancel 回傳 True 時，在下一個 Agent 開始前中止 pipeline"""
+
+
+@profiled()
+def run_full_pipeline(
+    customer_id: str,
+    use_similar_cache: bool = USE_SIMILAR_CACHE,
+    should_cancel: Optional[Callable[[], bool]] = None,
+) -> Dict:
     """
     給一個 customer_id，依序呼叫四個 Agent：
 
@@ -17,6 +36,13 @@ def run_full_pipeline(customer_id: str) -> Dict:
     3. Campaign Designer Agent   -> 挽留方案設計
     4. Communication Agent       -> Email / 簡訊 / 電話話術
 
+    use_similar_cache=True 時，若相似客戶快取中有夠接近、同價值分群、
+    同風險等級的鄰居結果，第 2、3 步直接沿用（只替換客戶專屬欄位），
+    省下兩次 LLM 呼叫；沒命中時照常執行並把結果放進快取。
+
+    should_cancel 會在每次呼叫 LLM 的 Agent 開始前被呼叫，回傳 True 時
+    丟出 PipelineCancelled（已送出的 LLM 呼叫無法中途取消）。
+
     回傳一個 dict，結構大致如下：
 
     {
@@ -24,18 +50,114 @@ def run_full_pipeline(customer_id: str) -> Dict:
         "analyst": { ... },
         "reasoning": { ... },
         "campaign": { ... },
-        "communications": { ... }
+        "communications": { ... },
+        "reused_from": { ... }   # 只有沿用相似客戶結果時才有
     }
     """
+    def checkpoint() -> None:
+        if should_cancel is not None and should_cancel():
+            raise PipelineCancelled(customer_id)
+
+    checkpoint()
     analyst = analyze_customer(customer_id)
-    reasoning = explain_churn_reason(customer_id, analyst)
-    campaign = design_campaign(customer_id, reasoning)
+
+    reused = None
+    if use_similar_cache:
+        value_segment = estimate_customer_value(query_customer_profile(customer_id))
+        reused = get_similar_cache().lookup(
+            customer_id, value_segment, analyst["churn_probability"]
+        )
+
+    if reused is not None:
+        reasoning = reused["reasoning"]
+        campaign = reused["campaign"]
+    else:
+        checkpoint()
+        reasoning = explain_churn_reason(customer_id, analyst)
+        checkpoint()
+        campaign = design_campaign(customer_id, reasoning)
+
+    checkpoint()
     communications = generate_communications(customer_id, campaign)
 
-    return {
+    result = {
         "customer_id": customer_id,
         "analyst": analyst,
         "reasoning": reasoning,
         "campaign": campaign,
         "communications": communications,
     }
+
+    if reused is not None:
+        result["reused_from"] = reused["reused_from"]
+    elif use_similar_cache:
+        get_similar_cache().insert(result)
+
+    return result
+
+
+@profiled()
+def run_batch_pipeline(
+    customer_ids: List[str],
+    store: Optional[ResultStore] = None,
+    flush_every: int = 20,
+    skip_stored: bool = True,
+) -> Dict:
+    """
+    批次跑多位客戶的 pipeline，結果每 flush_every 筆批次寫入結果儲存。
+    skip_stored=True 時，已經有目前版本結果的客戶會直接略過。
+
+    回傳 {"processed": 成功筆數, "skipped": 略過筆數, "failed": {customer_id: 錯誤訊息}}
+    """
+    store = store or get_result_store()
+    pending: List[Dict] = []
+    summary = {"processed": 0, "skipped": 0, "failed": {}}
+
+    for customer_id in customer_ids:
+        if skip_stored and store.load(customer_id) is not None:
+            summary["skipped"] += 1
+            continue
+        try:
+            pending.append(run_full_pipeline(customer_id))
+        except Exception as e:
+            summary["failed"][customer_id] = str(e)
+            continue
+        if len(pending) >= flush_every:
+            summary["processed"] += store.save_many(pending)
+            pending = []
+
+    summary["processed"] += store.save_many(pending)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批次執行 CRM AI agents pipeline")
+    parser.add_argument("customer_ids", nargs="*", help="要分析的 customerID")
+    parser.add_argument(
+        "--limit",
+        type=int,
+        default=10,
+        help="沒有指定 customerID 時，分析資料中前 N 位客戶",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="即使已有儲存結果也重新分析",
+    )
+    add_profiling_args(parser)
+    args = parser.parse_args()
+    configure_from_args(args)
+
+    customer_ids = args.customer_ids or list_customer_ids()[: args.limit]
+    summary = run_batch_pipeline(customer_ids, skip_stored=not args.force)
+
+    print(
+        f"完成 {summary['processed']} 位，略過 {summary['skipped']} 位（已有結果），"
+        f"失敗 {len(summary['failed'])} 位"
+    )
+    for customer_id, error in summary["failed"].items():
+        print(f"  {customer_id}: {error}")
+
+
+if __name__ == "__main__":
+    main()
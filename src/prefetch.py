@@ -0,0 +1,259 @@
+# src/prefetch.py
+
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from src.pipeline import PipelineCancelled, run_full_pipeline
+from src.profiling import profiled
+from src.result_store import ResultStore
+
+
+# 設 CRM_PREFETCH=1 時，Dashboard 選到客戶就先在背景跑 pipeline
+USE_PREFETCH = os.getenv("CRM_PREFETCH", "0") == "1"
+# 啟動時預先分析流失機率最高的前 N 位客戶
+PREFETCH_TOP_N = int(os.getenv("CRM_PREFETCH_TOP_N", "5"))
+# 同時在背景跑的 pipeline 數量上限
+PREFETCH_MAX_WORKERS = int(os.getenv("CRM_PREFETCH_MAX_WORKERS", "2"))
+# 預先分析（使用者還沒按按鈕）最多可花掉的 LLM 呼叫次數
+PREFETCH_MAX_CALLS = int(os.getenv("CRM_PREFETCH_MAX_CALLS", "200"))
+# 記住各 session 目前選擇的上限（session 關閉時不會通知，只能用數量控制）
+MAX_TRACKED_SESSIONS = 1000
+# 沒有結果儲存時，已完成、等人接上的預先分析結果最多保留幾筆（超過時丟掉最早的）
+MAX_READY_RESULTS = 100
+
+
+class _Job:
+    __slots__ = ("customer_id", "future", "cancel_event", "speculative", "kind")
+
+    def __init__(self, customer_id: str, kind: str, speculative: bool):
+        self.customer_id = customer_id
+        self.kind = kind  # "select" / "prewarm" / "demand"
+        self.speculative = speculative
+        self.cancel_event = threading.Event()
+        self.future: Optional[Future] = None
+
+
+class PipelinePrefetcher:
+    """
+    在背景預先執行 run_full_pipeline，讓使用者按下「開始分析」時不用從頭等。
+
+    - select()：使用者選到某位客戶就開始預先分析；同一個 session 換選別人時，
+      上一個還沒被使用的預先分析會被取消（排隊中直接取消，
+      執行中則在下一個 Agent 開始前中止）；其他 session 選的客戶不受影響
+    - prewarm()：預先分析一批客戶（例如流失機率最高的前 N 位），已有儲存結果的略過
+    - attach()：使用者按下按鈕時，接上進行中或已完成的結果；沒有就立刻開始
+    - 同時執行的數量受 thread pool 大小限制；預先分析所花的 LLM 呼叫次數
+      超過 max_speculative_calls 後就不再開始新的預先分析，進行中的也會停下
+    - 有傳入 store 時，預先分析完成的結果會直接寫入結果儲存，沒人按按鈕也不會浪費；
+      寫入後就不再留在記憶體中，之後一律從結果儲存讀取，不會拿到已被覆寫的舊結果
+    """
+
+    def __init__(
+        self,
+        max_workers: int = PREFETCH_MAX_WORKERS,
+        max_speculative_calls: int = PREFETCH_MAX_CALLS,
+        store: Optional[ResultStore] = None,
+    ):
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="crm-prefetch"
+        )
+        # 使用者按下按鈕的分析另外跑，不用排在預先分析後面
+        self._demand_executor = ThreadPoolExecutor(thread_name_prefix="crm-demand")
+        self.max_speculative_calls = max_speculative_calls
+        self.store = store
+        self._jobs: Dict[str, _Job] = {}
+        # 每個 session 目前選的客戶：{session_key: customer_id}
+        self._selected: Dict[str, str] = {}
+        # Future 被取消或建立時已完成，done callback 會在持有鎖的同一個 thread 執行
+        self._lock = threading.RLock()
+        self.stats = {
+            "started": 0,
+            "cancelled": 0,
+            "attached_hits": 0,
+            "attached_misses": 0,
+            "speculative_calls": 0,
+            "rejected_budget": 0,
+            "skipped_stored": 0,
+            "saved": 0,
+        }
+
+    def _budget_left(self) -> bool:
+        return self.stats["speculative_calls"] < self.max_speculative_calls
+
+    def _should_cancel(self, job: _Job) -> bool:
+        # run_full_pipeline 在每次呼叫 LLM 前會問一次，順便記錄預先分析的花費
+        with self._lock:
+            if job.cancel_event.is_set():
+                return True
+            if job.speculative:
+                if not self._budget_left():
+                    return True
+                self.stats["speculative_calls"] += 1
+            return False
+
+    def _run(self, job: _Job) -> Dict:
+        return run_full_pipeline(
+            job.customer_id, should_cancel=lambda: self._should_cancel(job)
+        )
+
+    def _submit(self, customer_id: str, kind: str, speculative: bool) -> Optional[Future]:
+        # 呼叫端需持有 self._lock
+        job = self._jobs.get(customer_id)
+        if job is not None and not job.cancel_event.is_set():
+            return job.future
+        if speculative and not self._budget_left():
+            self.stats["rejected_budget"] += 1
+            return None
+
+        job = _Job(customer_id, kind, speculative)
+        executor = self._executor if speculative else self._demand_executor
+        job.future = executor.submit(self._run, job)
+        job.future.add_done_callback(lambda f, job=job: self._on_done(job, f))
+        self._jobs[customer_id] = job
+        self.stats["started"] += 1
+        return job.future
+
+    def _forget(self, job: _Job) -> None:
+        # 呼叫端需持有 self._lock
+        if self._jobs.get(job.customer_id) is job:
+            del self._jobs[job.customer_id]
+
+    def _stored(self, customer_id: str) -> Optional[Future]:
+        # 呼叫端需持有 self._lock；預先分析完成後 job 已移除，結果改從結果儲存取得
+        if self.store is None:
+            return None
+        result = self.store.load(customer_id)
+        if result is None:
+            return None
+        future: Future = Future()
+        future.set_result(result)
+        return future
+
+    def _on_done(self, job: _Job, future: Future) -> None:
+        # 被取消或失敗的結果不保留，下次需要時重新開始
+        if future.cancelled() or future.exception() is not None:
+            with self._lock:
+                self._forget(job)
+            return
+        with self._lock:
+            speculative = job.speculative
+        # 使用者按按鈕接上的結果由呼叫端儲存；預先分析的結果在這裡存起來
+        saved = False
+        if self.store is not None and speculative:
+            self.store.save(future.result())
+            saved = True
+        with self._lock:
+            if saved:
+                self.stats["saved"] += 1
+            if saved or not job.speculative:
+                # 已寫入結果儲存，或呼叫端已經拿到 Future，不必再留著
+                self._forget(job)
+                return
+            # 沒有結果儲存時留給之後的 attach()，但數量有上限
+            ready = [j for j in self._jobs.values() if j.future.done()]
+            for old in ready[: max(len(ready) - MAX_READY_RESULTS, 0)]:
+                self._forget(old)
+
+    def _cancel(self, job: _Job) -> None:
+        # 呼叫端需持有 self._lock
+        job.cancel_event.set()
+        job.future.cancel()
+        self.stats["cancelled"] += 1
+
+    @profiled()
+    def select(self, customer_id: str, session_key: str) -> Optional[Future]:
+        """
+        某個 session 的使用者選到某位客戶：取消這個 session 上一位還在跑的預先分析
+        （其他 session 也選著同一位時保留），開始這一位
+        """
+        with self._lock:
+            previous_id = self._selected.get(session_key)
+            previous = self._jobs.get(previous_id) if previous_id else None
+            # 重新插入讓最近活動的 session 排在最後，超過上限時丟掉最久沒動的
+            self._selected.pop(session_key, None)
+            self._selected[session_key] = customer_id
+            while len(self._selected) > MAX_TRACKED_SESSIONS:
+                del self._selected[next(iter(self._selected))]
+            if (
+                previous is not None
+                and previous.customer_id != customer_id
+                and previous.kind == "select"
+                and previous.speculative
+                and not previous.future.done()
+                and previous.customer_id not in self._selected.values()
+            ):
+                self._cancel(previous)
+            current = self._jobs.get(customer_id)
+            if current is None or current.cancel_event.is_set():
+                stored = self._stored(customer_id)
+                if stored is not None:
+                    return stored
+            return self._submit(customer_id, "select", speculative=True)
+
+    def prewarm(self, customer_ids: List[str]) -> int:
+        """預先分析一批客戶（已有儲存結果的略過），回傳實際開始的數量"""
+        started = 0
+        with self._lock:
+            for customer_id in customer_ids:
+                if customer_id in self._jobs:
+                    continue
+                if self.store is not None and self.store.load(customer_id) is not None:
+                    self.stats["skipped_stored"] += 1
+                    continue
+                if self._submit(customer_id, "prewarm", speculative=True) is None:
+                    break
+                started += 1
+        return started
+
+    @profiled()
+    def attach(self, customer_id: str) -> Future:
+        """
+        使用者按下按鈕：回傳這位客戶進行中或已完成的 Future，
+        之後的 LLM 呼叫不再計入預先分析的花費，也不會被取消。
+        """
+        with self._lock:
+            job = self._jobs.get(customer_id)
+            if job is not None and not job.cancel_event.is_set():
+                if job.future.cancel():
+                    # 還在預先分析的佇列中排隊，改成立刻執行
+                    self._jobs.pop(customer_id, None)
+                    self.stats["attached_misses"] += 1
+                    return self._submit(customer_id, "demand", speculative=False)
+                job.speculative = False
+                job.kind = "demand"
+                self.stats["attached_hits"] += 1
+                if job.future.done():
+                    self._forget(job)
+                return job.future
+            stored = self._stored(customer_id)
+            if stored is not None:
+                # 預先分析已完成並寫入結果儲存
+                self.stats["attached_hits"] += 1
+                return stored
+            self.stats["attached_misses"] += 1
+            return self._submit(customer_id, "demand", speculative=False)
+
+    def metrics(self) -> Dict:
+        with self._lock:
+            stats = dict(self.stats)
+            stats["in_flight"] = sum(
+                1 for j in self._jobs.values() if not j.future.done()
+            )
+            stats["ready"] = sum(
+                1
+                for j in self._jobs.values()
+                if j.future.done()
+                and not j.future.cancelled()
+                and j.future.exception() is None
+            )
+        return stats
+
+
+def wait_attached(future: Future) -> Dict:
+    """等待 attach() 回傳的 Future；若剛好在 attach 前被取消，直接重跑一次"""
+    try:
+        return future.result()
+    except PipelineCancelled as e:
+        return run_full_pipeline(str(e))
@@ -0,0 +1,283 @@
+# src/profiling.py
+"""
+可選的效能分析（profiling）工具。
+
+預設關閉；開啟方式：
+- 環境變數：CRM_PROFILE=1（可加 CRM_PROFILE_MODE=cprofile / sampling）
+- CLI：有呼叫 add_profiling_args() 的指令都支援 --profile / --profile-mode
+
+開啟後：
+- 被 @profiled 包起來的函式、以及 with span(...) 區塊會記錄耗時，
+  輸出成 Chrome trace（profiles/trace-<pid>-<時間>.json），
+  可用 chrome://tracing、https://ui.perfetto.dev 或 speedscope 看 flame graph
+- mode=cprofile：另外輸出 cProfile 結果（.prof，可用 snakeviz 開啟；
+  注意 cProfile 只記錄開啟它的那個 thread）
+- mode=sampling：背景 thread 定期取樣所有 thread 的 call stack，
+  輸出 collapsed stacks（.folded，可用 flamegraph.pl / speedscope 開啟）
+
+關閉時 @profiled 只多一次全域布林檢查，span() 回傳共用的空物件。
+記憶體中只保留最近 CRM_PROFILE_MAX_EVENTS 筆 span（預設 100000），
+長時間執行的服務 trace 檔與記憶體都不會無限增長；較早的 span 會被丟掉。
+"""
+
+import argparse
+import atexit
+import cProfile
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+PROFILE_DIR = Path(os.getenv("CRM_PROFILE_DIR", "profiles"))
+SAMPLING_INTERVAL = 0.005  # 秒
+MAX_EVENTS = int(os.getenv("CRM_PROFILE_MAX_EVENTS", "100000"))
+
+_enabled = False
+_mode: Optional[str] = None
+_events: deque = deque(maxlen=MAX_EVENTS)
+_dropped_events = 0
+_events_lock = threading.Lock()
+_run_started = ""
+_profiler: Optional[cProfile.Profile] = None
+_sampler: Optional["_StackSampler"] = None
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("name", "cat", "start")
+
+    def __init__(self, name: str, cat: str):
+        self.name = name
+        self.cat = cat
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter_ns()
+        event = {
+            "name": self.name,
+            "cat": self.cat,
+            "ph": "X",
+            "ts": self.start / 1000.0,
+            "dur": (end - self.start) / 1000.0,
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+        }
+        global _dropped_events
+        with _events_lock:
+            if len(_events) == _events.maxlen:
+                _dropped_events += 1
+            _events.append(event)
+        return False
+
+
+def span(name: str, cat: str = "crm"):
+    """記錄一段程式碼的耗時：with span("data_analyst.build_prompt"): ..."""
+    if not _enabled:
+        return _NULL_SPAN
+    return _Span(name, cat)
+
+
+def profiled(name: Optional[str] = None, cat: str = "crm") -> Callable:
+    """
+    函式耗時記錄用的 decorator。
+    跟 lru_cache 一起用時請放在 lru_cache 下面，只記錄真正的載入而不是快取命中。
+    """
+
+    def decorator(fn: Callable) -> Callable:
+        span_name = name or f"{fn.__module__}.{fn.__qualname__}"
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            with _Span(span_name, cat):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class _StackSampler(threading.Thread):
+    """定期取樣所有 thread 的 call stack，累積成 collapsed stacks"""
+
+    def __init__(self, interval: float = SAMPLING_INTERVAL):
+        super().__init__(name="crm-stack-sampler", daemon=True)
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        own_id = threading.get_ident()
+        while not self._stop_event.wait(self.interval):
+            for tid, frame in sys._current_frames().items():
+                if tid == own_id:
+                    continue
+                names = []
+                while frame is not None:
+                    code = frame.f_code
+                    names.append(f"{code.co_name} ({Path(code.co_filename).name})")
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(names))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def enable_profiling(mode: Optional[str] = None) -> None:
+    """開啟 profiling；mode 可為 None / "cprofile" / "sampling"。程式結束時自動輸出結果。"""
+    global _enabled, _mode, _run_started, _profiler, _sampler
+    if _enabled:
+        return
+    if mode not in (None, "cprofile", "sampling"):
+        raise ValueError(f"不支援的 profiling 模式：{mode}")
+
+    _enabled = True
+    _mode = mode
+    _run_started = time.strftime("%Y%m%d-%H%M%S")
+
+    if mode == "cprofile":
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+    elif mode == "sampling":
+        _sampler = _StackSampler()
+        _sampler.start()
+
+    atexit.register(finish_profiling)
+
+
+def _reset_after_fork() -> None:
+    # fork 出來的 worker 不要帶著 parent 已記錄的 span；取樣 thread 也要重新啟動
+    global _sampler, _dropped_events
+    _events.clear()
+    _dropped_events = 0
+    if _sampler is not None:
+        _sampler = _StackSampler(_sampler.interval)
+        _sampler.start()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _run_name() -> str:
+    # 每個 process（包含 fork 出來的 worker）各自一組檔名
+    return f"{os.getpid()}-{_run_started}"
+
+
+def write_trace() -> Optional[Path]:
+    """把目前累積的 span 寫成 Chrome trace JSON（可重複呼叫，會覆寫同一個檔案）"""
+    if not _enabled:
+        return None
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    path = PROFILE_DIR / f"trace-{_run_name()}.json"
+    with _events_lock:
+        events = list(_events)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+    return path
+
+
+def summarize_spans() -> Dict[str, Dict]:
+    """依 span 名稱彙總：次數、總耗時、平均耗時（毫秒）；只涵蓋目前保留的最近 MAX_EVENTS 筆"""
+    with _events_lock:
+        events = list(_events)
+    summary: Dict[str, Dict] = {}
+    for e in events:
+        s = summary.setdefault(e["name"], {"count": 0, "total_ms": 0.0})
+        s["count"] += 1
+        s["total_ms"] += e["dur"] / 1000.0
+    for s in summary.values():
+        s["mean_ms"] = s["total_ms"] / s["count"]
+    return summary
+
+
+def reset_spans() -> None:
+    """清掉目前累積的 span（例如壓力測試每一輪分開統計）"""
+    global _dropped_events
+    with _events_lock:
+        _events.clear()
+        _dropped_events = 0
+
+
+def finish_profiling() -> None:
+    """停止取樣並輸出所有 profiling 結果"""
+    global _enabled, _profiler, _sampler
+    if not _enabled:
+        return
+
+    trace_path = write_trace()
+    print(f"[profiling] trace 已輸出到 {trace_path}", file=sys.stderr)
+    if _dropped_events:
+        print(
+            f"[profiling] 超過 {MAX_EVENTS} 筆上限，較早的 {_dropped_events} 筆 span 未保留",
+            file=sys.stderr,
+        )
+
+    if _profiler is not None:
+        _profiler.disable()
+        prof_path = PROFILE_DIR / f"cprofile-{_run_name()}.prof"
+        _profiler.dump_stats(prof_path)
+        _profiler = None
+        print(f"[profiling] cProfile 已輸出到 {prof_path}", file=sys.stderr)
+
+    if _sampler is not None:
+        _sampler.stop()
+        folded_path = PROFILE_DIR / f"samples-{_run_name()}.folded"
+        with open(folded_path, "w", encoding="utf-8") as f:
+            for stack, count in _sampler.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        _sampler = None
+        print(f"[profiling] 取樣結果已輸出到 {folded_path}", file=sys.stderr)
+
+    _enabled = False
+
+
+def add_profiling_args(parser: argparse.ArgumentParser) -> None:
+    """幫 CLI 加上 --profile / --profile-mode 參數"""
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="開啟 profiling，輸出 Chrome trace 到 profiles/",
+    )
+    parser.add_argument(
+        "--profile-mode",
+        choices=["cprofile", "sampling"],
+        default=None,
+        help="另外記錄 cProfile 或取樣式 profiler 的結果",
+    )
+
+
+def configure_from_args(args: argparse.Namespace) -> None:
+    """依 CLI 參數開啟 profiling（環境變數已開啟時不影響）"""
+    if getattr(args, "profile", False) or getattr(args, "profile_mode", None):
+        enable_profiling(args.profile_mode)
+
+
+if os.getenv("CRM_PROFILE", "0") == "1":
+    enable_profiling(os.getenv("CRM_PROFILE_MODE") or None)
@@ -0,0 +1,90 @@
+# src/prompt_report.py
+
+import argparse
+import os
+from typing import Dict, List, Optional
+
+from src import prompting
+from src.fake_llm_server import start_fake_llm_server
+
+STAGES = ("data_analyst", "churn_reasoning", "campaign_designer", "communication")
+
+
+def measure(customer_ids: List[str], compact: bool) -> Dict[str, Dict]:
+    """用指定的 prompt 模式跑一次 pipeline（不用相似客戶快取、不寫入結果儲存），回傳各 Agent 的統計"""
+    # agents 在 import 時就建立 LLM client，所以要等 OPENAI_BASE_URL 設好才 import
+    from src.pipeline import run_full_pipeline
+
+    prompting.COMPACT_PROMPTS = compact
+    prompting.reset_prompt_stats()
+    for customer_id in customer_ids:
+        run_full_pipeline(customer_id, use_similar_cache=False)
+    return prompting.prompt_stats()
+
+
+def _fmt(value: Optional[float], spec: str = ".0f", unit: str = "") -> str:
+    return "-" if value is None else f"{value:{spec}}{unit}"
+
+
+def print_report(before: Dict[str, Dict], after: Dict[str, Dict]) -> None:
+    print(
+        f"{'stage':<20}{'tokens 前':>10}{'tokens 後':>10}{'減少':>8}"
+        f"{'延遲 前':>11}{'延遲 後':>11}{'p95 後':>11}"
+        f"{'固定前綴':>10}{'超出上限':>10}{'快取命中':>10}"
+    )
+    for stage in STAGES:
+        b, a = before.get(stage), after.get(stage)
+        if not b or not a or not b["calls"] or not a["calls"]:
+            continue
+        saved = 1 - a["mean_prompt_tokens"] / b["mean_prompt_tokens"]
+        cached = a["cached_ratio"]
+        print(
+            f"{stage:<20}{b['mean_prompt_tokens']:>10.0f}{a['mean_prompt_tokens']:>10.0f}"
+            f"{saved * 100:>7.1f}%"
+            f"{b['mean_latency_ms']:>9.0f}ms{a['mean_latency_ms']:>9.0f}ms"
+            f"{a['p95_latency_ms']:>9.0f}ms"
+            f"{_fmt(a['static_prefix_tokens']):>10}{a['over_budget']:>10}"
+            f"{_fmt(cached * 100 if cached is not None else None, '.0f', '%'):>10}"
+        )
+    print(
+        f"\ntoken 數為本機 tokenizer 計算（{prompting.tokenizer_name()}），"
+        "延遲為各 Agent 的 LLM 呼叫平均耗時；快取命中為 provider 回報的 cached tokens 比例。"
+        f"\n固定前綴（system + 指示）低於 {prompting.PROVIDER_CACHE_MIN_TOKENS} token 時，"
+        "OpenAI 的 prompt caching 不會生效。"
+        "\n「前」是目前 prompt 的非精簡模式（CRM_COMPACT_PROMPTS=0），指示文字已是新版，"
+        "並非改版前實際使用的 prompt，減少比例只反映 profile 精簡、上游濃縮與截短的效果。"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="比較非精簡與精簡模式下各 Agent 的 prompt token 數與延遲")
+    parser.add_argument("customer_ids", nargs="*", help="要分析的 customerID")
+    parser.add_argument("--limit", type=int, default=5, help="沒有指定 customerID 時，分析前 N 位客戶")
+    parser.add_argument(
+        "--fake-llm",
+        action="store_true",
+        help="改用本機假 LLM 服務（延遲依 prompt 長度增加），不花 API 費用",
+    )
+    parser.add_argument("--fake-ms-per-1k-prompt-tokens", type=float, default=400.0)
+    args = parser.parse_args()
+
+    if args.fake_llm:
+        _, base_url = start_fake_llm_server(
+            latency_ms=300.0,
+            jitter_ms=50.0,
+            ms_per_1k_prompt_tokens=args.fake_ms_per_1k_prompt_tokens,
+        )
+        os.environ["OPENAI_BASE_URL"] = base_url
+        os.environ.setdefault("OPENAI_API_KEY", "fake")
+
+    from src.tools import list_customer_ids
+
+    customer_ids = args.customer_ids or list_customer_ids()[: args.limit]
+    before = measure(customer_ids, compact=False)
+    after = measure(customer_ids, compact=True)
+    print(f"客戶數：{len(customer_ids)}（前：非精簡模式，後：精簡模式）\n")
+    print_report(before, after)
+
+
+if __name__ == "__main__":
+    main()
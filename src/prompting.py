@@ -0,0 +1,343 @@
+# src/prompting.py
+
+import math
+import os
+import re
+import sys
+import threading
+from collections import deque
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+try:
+    import tiktoken
+except ImportError:  # 沒裝 tiktoken 時改用字元數估算
+    tiktoken = None
+
+
+# 設 CRM_COMPACT_PROMPTS=0 改用非精簡模式（完整 profile、完整上游輸出、資料在前），
+# 用來比較前後差異；指示文字沿用目前版本，所以只是近似舊版 prompt
+COMPACT_PROMPTS = os.getenv("CRM_COMPACT_PROMPTS", "1") == "1"
+
+# gpt-4.1 / gpt-4o 系列使用的 tokenizer
+TOKENIZER_ENCODING = "o200k_base"
+
+# 每個 Agent 一次呼叫（system + user prompt）的 token 上限；
+# 超過時先截短上游 Agent 的輸出，其他欄位不動
+PROMPT_TOKEN_BUDGETS = {
+    "data_analyst": 900,
+    "churn_reasoning": 1100,
+    "campaign_designer": 1200,
+    "communication": 1200,
+}
+# 上游輸出至少保留的 token 數，避免固定內容太長時整段被砍掉；
+# 因此固定內容本身就超過上限時，最終 prompt 仍可能超出，compose_prompt 會記錄並警告
+MIN_UPSTREAM_TOKENS = 120
+
+# OpenAI 的 prompt caching 只對 1024 token 以上、且前綴完全相同的 prompt 生效。
+# 目前各 Agent 的固定前綴（system + 指示）約 250~450 token，整個 prompt 也在上限 1200 以內，
+# 所以實際上不會命中；固定內容放前面是為了指示變長或改用門檻較低的 provider 時能直接受惠，
+# prompt_report 會列出各 Agent 的固定前綴長度方便對照
+PROVIDER_CACHE_MIN_TOKENS = 1024
+
+# 延遲 p95 只看最近這麼多次呼叫，長時間執行的 Dashboard 記憶體不會一直長
+STATS_WINDOW = 1000
+
+# 傳給下一個 Agent 時，各 Agent 輸出只保留這幾點（對應 prompt 要求的編號段落）
+KEY_SECTIONS = {
+    "analysis": (1,),  # 風險評估；主要影響因素另外以結構化資料傳遞
+    "reasoning": (1, 2),  # 原因總結 + 關鍵因素
+    "campaign": (2,),  # 挽留方案本身
+}
+
+TRUNCATED_MARK = "…（以下省略）"
+
+
+@lru_cache(maxsize=1)
+def _load_encoding():
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.get_encoding(TOKENIZER_ENCODING)
+    except Exception:
+        # 第一次使用需下載詞表，離線環境會失敗，改用估算
+        return None
+
+
+def tokenizer_name() -> str:
+    return f"tiktoken {TOKENIZER_ENCODING}" if _load_encoding() is not None else "字元數估算"
+
+
+def _estimate_tokens(text: str) -> int:
+    # 中文字大約一個字一個 token，英數字大約 4 個字元一個 token
+    non_ascii = sum(1 for ch in text if ord(ch) > 127)
+    return non_ascii + math.ceil((len(text) - non_ascii) / 4)
+
+
+def count_tokens(text: str) -> int:
+    """用本機 tokenizer 計算 token 數（沒有 tiktoken 時為估算值）"""
+    if not text:
+        return 0
+    encoding = _load_encoding()
+    if encoding is None:
+        return _estimate_tokens(text)
+    return len(encoding.encode(text))
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """截短到 max_tokens 以內，盡量在換行處切開"""
+    if count_tokens(text) <= max_tokens:
+        return text
+
+    budget = max(max_tokens - count_tokens(TRUNCATED_MARK), 0)
+    kept: List[str] = []
+    used = 0
+    for line in text.splitlines():
+        cost = count_tokens(line + "\n")
+        if used + cost > budget:
+            if not kept:
+                # 第一行就超過：直接依字元切
+                encoding = _load_encoding()
+                if encoding is not None:
+                    kept.append(encoding.decode(encoding.encode(line)[:budget]))
+                else:
+                    # 估算時每個字元最多算一個 token
+                    kept.append(line[:budget])
+            break
+        kept.append(line)
+        used += cost
+    return "\n".join(kept + [TRUNCATED_MARK])
+
+
+def extract_numbered_section(text: str, section_no: int = 1) -> str:
+    """
+    從 LLM 的輸出中抽出「第 N 點」的內容：
+    - 假設內容是這種格式：
+        1. xxx
+           xxx
+        2. yyy
+           1. 段落內的編號清單
+    - 縮排最淺的「數字.」開頭行才算段落標題，縮排較深的編號屬於段落內容；
+      擷取從 `N.` 標題那一行開始，一直到下一個段落標題之前。
+    """
+    if not text:
+        return ""
+
+    lines = text.splitlines()
+    indents = [
+        len(line) - len(line.lstrip())
+        for line in lines
+        if re.match(r"^[0-9]+\.", line.strip())
+    ]
+    if not indents:
+        return text.strip()
+    top = min(indents)
+
+    def is_heading(line: str) -> bool:
+        return len(line) - len(line.lstrip()) == top and re.match(r"^[0-9]+\.", line.strip())
+
+    start_prefix = f"{section_no}."
+    captured = []
+    capturing = False
+
+    for line in lines:
+        stripped = line.strip()
+        if not capturing:
+            if is_heading(line) and stripped.startswith(start_prefix):
+                capturing = True
+                captured.append(stripped)
+        else:
+            # 遇到同一層的「數字.」開頭，就代表下一段開始了
+            if is_heading(line):
+                break
+            # 保留段落內相對的縮排（巢狀清單）
+            captured.append(line[min(top, len(line) - len(line.lstrip())):].rstrip())
+
+    if not captured:
+        # 如果沒抓到，就退而求其次回傳全文
+        return text.strip()
+
+    return "\n".join(captured).strip()
+
+
+def condense_output(text: str, kind: str) -> str:
+    """
+    把上游 Agent 的輸出濃縮成 KEY_SECTIONS 指定的段落再往下傳。
+    格式不符（找不到編號段落）時回傳全文，交給 token 上限截短。
+    """
+    if not COMPACT_PROMPTS or not text:
+        return text or ""
+    sections = []
+    for section_no in KEY_SECTIONS[kind]:
+        section = extract_numbered_section(text, section_no)
+        if section == text.strip():
+            return section
+        sections.append(section)
+    return "\n".join(sections)
+
+
+def _format_value(value) -> Optional[str]:
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    if isinstance(value, (float, np.floating)):
+        value = float(value)
+        return str(int(value)) if value.is_integer() else f"{value:.2f}".rstrip("0")
+    if isinstance(value, np.integer):
+        return str(int(value))
+    return str(value)
+
+
+def format_profile(profile: Dict) -> str:
+    """
+    客戶資料的精簡、穩定寫法：依欄位原本的順序寫成「欄位=值」，
+    略過 customerID（prompt 中另外給）與空值，數值去掉多餘的小數位。
+    """
+    if not COMPACT_PROMPTS:
+        return str(profile)
+    parts = []
+    for key, value in profile.items():
+        if key == "customerID":
+            continue
+        text = _format_value(value)
+        if text is not None:
+            parts.append(f"{key}={text}")
+    return ", ".join(parts)
+
+
+def compose_prompt(
+    stage: str,
+    system_prompt: str,
+    intro: str,
+    blocks: Sequence[Tuple[str, str]],
+    instructions: str,
+    upstream: Optional[Tuple[str, str]] = None,
+) -> str:
+    """
+    組出 user prompt。
+
+    精簡模式下，不變的內容（intro、instructions）放在最前面、每位客戶不同的資料放在後面
+    （見 PROVIDER_CACHE_MIN_TOKENS 關於 prefix cache 的說明）；上游 Agent 的輸出（upstream）
+    放在最後，整體超過 PROMPT_TOKEN_BUDGETS[stage] 時只截短這一段。
+    最終的 prompt 一律再檢查一次上限，超過時記錄在統計中並輸出警告。
+    非精簡模式維持原本「資料在前、指示在後」的順序，也不做截短與檢查。
+    """
+    def render(items: Iterable[Tuple[str, str]]) -> str:
+        return "\n\n".join(f"【{title}】\n{content}" for title, content in items)
+
+    intro = intro.strip()
+    instructions = instructions.strip()
+
+    if not COMPACT_PROMPTS:
+        items = list(blocks) + ([upstream] if upstream else [])
+        return f"{intro}\n\n{render(items)}\n\n{instructions}"
+
+    static_prefix = f"{intro}\n\n{instructions}"
+    prompt = f"{static_prefix}\n\n{render(blocks)}"
+    budget = PROMPT_TOKEN_BUDGETS[stage]
+
+    if upstream is not None:
+        title, text = upstream
+        fixed = count_tokens(system_prompt) + count_tokens(prompt) + count_tokens(f"\n\n【{title}】\n")
+        upstream_budget = max(budget - fixed, MIN_UPSTREAM_TOKENS)
+        prompt = f"{prompt}\n\n{render([(title, truncate_to_tokens(text, upstream_budget))])}"
+
+    total = count_tokens(system_prompt) + count_tokens(prompt)
+    _record_prompt(stage, total, count_tokens(system_prompt) + count_tokens(static_prefix), budget)
+    if total > budget:
+        print(
+            f"[prompting] {stage} 的 prompt 有 {total} token，超過上限 {budget}",
+            file=sys.stderr,
+        )
+    return prompt
+
+
+# ---- 每個 Agent 的 prompt 大小與延遲統計 ----
+# 只保留累計值與最近 STATS_WINDOW 次的延遲，長時間執行也不會一直佔用記憶體
+
+_stats: Dict[str, Dict] = {}
+_stats_lock = threading.Lock()
+
+
+def _stage_stats(stage: str) -> Dict:
+    # 呼叫端需持有 _stats_lock
+    s = _stats.get(stage)
+    if s is None:
+        s = _stats[stage] = {
+            "calls": 0,
+            "prompt_tokens": 0,
+            "latency_ms": 0.0,
+            "recent_latency_ms": deque(maxlen=STATS_WINDOW),
+            "usage_calls": 0,
+            "usage_prompt_tokens": 0,
+            "cached_tokens": 0,
+            "composed": 0,
+            "over_budget": 0,
+            "static_prefix_tokens": None,
+        }
+    return s
+
+
+def _record_prompt(stage: str, total_tokens: int, static_prefix_tokens: int, budget: int) -> None:
+    with _stats_lock:
+        s = _stage_stats(stage)
+        s["composed"] += 1
+        s["static_prefix_tokens"] = static_prefix_tokens
+        if total_tokens > budget:
+            s["over_budget"] += 1
+
+
+def record_llm_call(stage: str, prompt_tokens: int, latency_ms: float, usage=None) -> None:
+    """由 call_llm 呼叫：記錄本機計算的 prompt token 數、延遲與 provider 回報的用量"""
+    details = getattr(usage, "prompt_tokens_details", None)
+    with _stats_lock:
+        s = _stage_stats(stage)
+        s["calls"] += 1
+        s["prompt_tokens"] += prompt_tokens
+        s["latency_ms"] += latency_ms
+        s["recent_latency_ms"].append(latency_ms)
+        if usage is not None:
+            s["usage_calls"] += 1
+            s["usage_prompt_tokens"] += getattr(usage, "prompt_tokens", 0) or 0
+            s["cached_tokens"] += getattr(details, "cached_tokens", 0) or 0
+
+
+def prompt_stats() -> Dict[str, Dict]:
+    """
+    依 Agent 彙總：呼叫次數、平均 prompt token、平均延遲與最近 STATS_WINDOW 次的 p95、
+    provider 回報的 token 與快取命中比例、超過 token 上限的次數、固定前綴的 token 數
+    """
+    with _stats_lock:
+        stats = {
+            stage: dict(s, recent_latency_ms=list(s["recent_latency_ms"]))
+            for stage, s in _stats.items()
+        }
+
+    summary = {}
+    for stage, s in stats.items():
+        calls = s["calls"]
+        summary[stage] = {
+            "calls": calls,
+            "mean_prompt_tokens": s["prompt_tokens"] / calls if calls else None,
+            "mean_latency_ms": s["latency_ms"] / calls if calls else None,
+            "p95_latency_ms": (
+                float(np.percentile(s["recent_latency_ms"], 95)) if calls else None
+            ),
+            "mean_usage_prompt_tokens": (
+                s["usage_prompt_tokens"] / s["usage_calls"] if s["usage_calls"] else None
+            ),
+            "cached_ratio": (
+                s["cached_tokens"] / s["usage_prompt_tokens"]
+                if s["usage_prompt_tokens"]
+                else None
+            ),
+            "over_budget": s["over_budget"],
+            "static_prefix_tokens": s["static_prefix_tokens"],
+        }
+    return summary
+
+
+def reset_prompt_stats() -> None:
+    with _stats_lock:
+        _stats.clear()
@@ -0,0 +1,219 @@
+# src/result_store.py
+
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from src.agents import PROMPT_VERSION
+from src.profiling import profiled
+from src.tools import get_model_version, risk_level
+
+
+RESULT_DB_PATH = Path(os.getenv("CRM_RESULT_DB", "data/results/pipeline_results.db"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pipeline_results (
+    customer_id       TEXT NOT NULL,
+    model_version     TEXT NOT NULL,
+    prompt_version    TEXT NOT NULL,
+    churn_probability REAL NOT NULL,
+    risk_level        TEXT NOT NULL,
+    value_segment     TEXT NOT NULL,
+    created_at        TEXT NOT NULL,
+    result_json       TEXT NOT NULL,
+    PRIMARY KEY (customer_id, model_version, prompt_version)
+);
+CREATE INDEX IF NOT EXISTS idx_results_risk_level
+    ON pipeline_results (risk_level, created_at);
+CREATE INDEX IF NOT EXISTS idx_results_value_segment
+    ON pipeline_results (value_segment, created_at);
+CREATE INDEX IF NOT EXISTS idx_results_created_at
+    ON pipeline_results (created_at);
+"""
+
+_UPSERT = """
+INSERT OR REPLACE INTO pipeline_results (
+    customer_id, model_version, prompt_version,
+    churn_probability, risk_level, value_segment, created_at, result_json
+) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+def _utc_now() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+
+def start_of_week(now: Optional[datetime] = None) -> datetime:
+    """本週一 00:00（當地時間），轉成 UTC"""
+    now = (now or datetime.now()).astimezone()
+    monday = (now - timedelta(days=now.weekday())).replace(
+        hour=0, minute=0, second=0, microsecond=0
+    )
+    return monday.astimezone(timezone.utc)
+
+
+class ResultStore:
+    """
+    run_full_pipeline 結果的 SQLite 儲存（WAL 模式）。
+
+    - 以 (customer_id, model_version, prompt_version) 為主鍵，
+      模型重新訓練或 prompt 改版後，舊結果不會被誤用
+    - risk_level / value_segment / created_at 都有 index，方便查詢歷史結果
+    - 每個 thread 各自持有一條連線（sqlite3 連線不能跨 thread 共用）
+    """
+
+    def __init__(self, db_path: Path = RESULT_DB_PATH):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _row_values(
+        result: Dict,
+        model_version: str,
+        prompt_version: str,
+        created_at: str,
+    ) -> tuple:
+        prob = float(result["analyst"]["churn_probability"])
+        return (
+            result["customer_id"],
+            model_version,
+            prompt_version,
+            prob,
+            risk_level(prob),
+            result["campaign"]["value_segment"],
+            created_at,
+            json.dumps(result, ensure_ascii=False),
+        )
+
+    def save(self, result: Dict) -> None:
+        """儲存單筆結果（同一客戶、同版本會覆蓋）"""
+        self.save_many([result])
+
+    @profiled()
+    def save_many(self, results: Iterable[Dict]) -> int:
+        """批次寫入多筆結果，整批在同一個 transaction 內完成，回傳筆數"""
+        model_version = get_model_version()
+        created_at = _utc_now()
+        rows = [
+            self._row_values(r, model_version, PROMPT_VERSION, created_at)
+            for r in results
+        ]
+        if not rows:
+            return 0
+        with self._conn() as conn:
+            conn.executemany(_UPSERT, rows)
+        return len(rows)
+
+    @profiled()
+    def load(
+        self,
+        customer_id: str,
+        model_version: Optional[str] = None,
+        prompt_version: Optional[str] = None,
+    ) -> Optional[Dict]:
+        """
+        讀取某位客戶已儲存的結果（預設只找目前模型與 prompt 版本），
+        沒有就回傳 None。回傳的 dict 會多一個 "stored_at" 欄位。
+        """
+        row = self._conn().execute(
+            """
+            SELECT result_json, created_at FROM pipeline_results
+            WHERE customer_id = ? AND model_version = ? AND prompt_version = ?
+            """,
+            (
+                customer_id,
+                model_version or get_model_version(),
+                prompt_version or PROMPT_VERSION,
+            ),
+        ).fetchone()
+        if row is None:
+            return None
+        result = json.loads(row["result_json"])
+        result["stored_at"] = row["created_at"]
+        return result
+
+    @profiled()
+    def query(
+        self,
+        risk_level: Optional[str] = None,
+        value_segment: Optional[str] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        current_versions_only: bool = True,
+        include_results: bool = False,
+        limit: Optional[int] = None,
+    ) -> List[Dict]:
+        """
+        查詢已儲存的結果摘要（依時間新到舊），例如：
+            store.query(risk_level="高風險", since=start_of_week())
+
+        include_results=True 時會附上完整的 pipeline 結果（"result" 欄位）。
+        """
+        columns = (
+            "customer_id, model_version, prompt_version, churn_probability, "
+            "risk_level, value_segment, created_at"
+        )
+        if include_results:
+            columns += ", result_json"
+
+        clauses: List[str] = []
+        params: List = []
+        if risk_level is not None:
+            clauses.append("risk_level = ?")
+            params.append(risk_level)
+        if value_segment is not None:
+            clauses.append("value_segment = ?")
+            params.append(value_segment)
+        if since is not None:
+            clauses.append("created_at >= ?")
+            params.append(since.astimezone(timezone.utc).isoformat(timespec="seconds"))
+        if until is not None:
+            clauses.append("created_at < ?")
+            params.append(until.astimezone(timezone.utc).isoformat(timespec="seconds"))
+        if current_versions_only:
+            clauses.append("model_version = ? AND prompt_version = ?")
+            params.extend([get_model_version(), PROMPT_VERSION])
+
+        sql = f"SELECT {columns} FROM pipeline_results"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY created_at DESC"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(int(limit))
+
+        rows = []
+        for row in self._conn().execute(sql, params):
+            item = dict(row)
+            if include_results:
+                item["result"] = json.loads(item.pop("result_json"))
+            rows.append(item)
+        return rows
+
+    def high_risk_this_week(self, **kwargs) -> List[Dict]:
+        """本週分析過的高風險客戶"""
+        return self.query(risk_level="高風險", since=start_of_week(), **kwargs)
+
+
+@lru_cache(maxsize=1)
+def get_result_store() -> ResultStore:
+    """整個 process 共用的結果儲存"""
+    return ResultStore()
@@ -0,0 +1,126 @@
+# src/scoring_load_test.py
+
+import argparse
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+import numpy as np
+
+from src.scoring_service import DEFAULT_HOST, DEFAULT_PORT
+from src.tools import list_customer_ids
+
+
+def _request(url: str, body: bytes = None) -> int:
+    req = urllib.request.Request(
+        url,
+        data=body,
+        headers={"Content-Type": "application/json"} if body else {},
+    )
+    with urllib.request.urlopen(req, timeout=30) as resp:
+        resp.read()
+        return resp.status
+
+
+def run_load_test(
+    base_url: str,
+    customer_ids: List[str],
+    concurrency: int = 16,
+    duration: float = 10.0,
+    batch_size: int = 0,
+) -> Dict:
+    """
+    以 concurrency 個 thread 持續打評分服務 duration 秒。
+    batch_size=0 打單筆端點 /score/<id>；> 0 時打 /score/batch，每次帶 batch_size 位客戶。
+    """
+    latencies: List[float] = []
+    errors = 0
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + duration
+
+    def worker(seed: int) -> None:
+        nonlocal errors
+        rng = random.Random(seed)
+        local_lat: List[float] = []
+        local_err = 0
+        while time.perf_counter() < stop_at:
+            if batch_size > 0:
+                url = f"{base_url}/score/batch"
+                body = json.dumps(
+                    {"customer_ids": rng.sample(customer_ids, batch_size)}
+                ).encode("utf-8")
+            else:
+                url = f"{base_url}/score/{rng.choice(customer_ids)}"
+                body = None
+
+            start = time.perf_counter()
+            try:
+                _request(url, body)
+            except (urllib.error.URLError, OSError):
+                local_err += 1
+                continue
+            local_lat.append(time.perf_counter() - start)
+
+        with lock:
+            latencies.extend(local_lat)
+            errors += local_err
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    lat_ms = np.asarray(latencies) * 1000.0
+    n = len(lat_ms)
+    return {
+        "requests": n,
+        "errors": errors,
+        "elapsed_s": elapsed,
+        "qps": n / elapsed if elapsed else 0.0,
+        "customers_per_s": n * max(batch_size, 1) / elapsed if elapsed else 0.0,
+        "p50_ms": float(np.percentile(lat_ms, 50)) if n else None,
+        "p95_ms": float(np.percentile(lat_ms, 95)) if n else None,
+        "p99_ms": float(np.percentile(lat_ms, 99)) if n else None,
+        "max_ms": float(lat_ms.max()) if n else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="churn 評分服務壓力測試")
+    parser.add_argument("--url", default=f"http://{DEFAULT_HOST}:{DEFAULT_PORT}")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10.0, help="秒")
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=0,
+        help="0 = 打單筆端點；> 0 = 打批次端點，每次帶 N 位客戶",
+    )
+    args = parser.parse_args()
+
+    report = run_load_test(
+        args.url.rstrip("/"),
+        list_customer_ids(),
+        concurrency=args.concurrency,
+        duration=args.duration,
+        batch_size=args.batch_size,
+    )
+
+    print("=== Scoring Service Load Test ===")
+    print(f"concurrency={args.concurrency}  batch_size={args.batch_size}")
+    print(f"requests : {report['requests']}（errors: {report['errors']}）")
+    print(f"QPS      : {report['qps']:.1f}（{report['customers_per_s']:.1f} customers/s）")
+    if report["requests"]:
+        print(
+            f"latency  : p50={report['p50_ms']:.2f}ms  p95={report['p95_ms']:.2f}ms  "
+            f"p99={report['p99_ms']:.2f}ms  max={report['max_ms']:.2f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
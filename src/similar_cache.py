@@ -0,0 +1,255 @@
+# src/similar_cache.py
+
+import os
+import threading
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from src.profiling import profiled
+from src.result_store import get_result_store
+from src.tools import _load_churn_df, _load_feature_cols, risk_level
+
+
+# 標準化特徵空間中的歐氏距離上限，超過就不沿用鄰居的結果
+DEFAULT_MAX_DISTANCE = float(os.getenv("CRM_SIMILAR_MAX_DISTANCE", "0.5"))
+# 品質防護：流失機率差距超過這個值也不沿用（即使特徵很接近）
+DEFAULT_MAX_PROB_DELTA = float(os.getenv("CRM_SIMILAR_MAX_PROB_DELTA", "0.05"))
+
+_INITIAL_CAPACITY = 64
+
+
+class _Bucket:
+    """同一個（價值分群, 風險等級）底下已有結果的客戶向量，支援逐筆新增"""
+
+    def __init__(self, dim: int):
+        self.ids: List[str] = []
+        self.vectors = np.empty((_INITIAL_CAPACITY, dim), dtype=float)
+
+    def add(self, customer_id: str, vector: np.ndarray) -> None:
+        n = len(self.ids)
+        if n == self.vectors.shape[0]:
+            grown = np.empty((n * 2, self.vectors.shape[1]), dtype=float)
+            grown[:n] = self.vectors
+            self.vectors = grown
+        self.vectors[n] = vector
+        self.ids.append(customer_id)
+
+    def remove(self, customer_id: str) -> None:
+        # 用最後一筆補上被移除的位置
+        i = self.ids.index(customer_id)
+        last = len(self.ids) - 1
+        self.vectors[i] = self.vectors[last]
+        self.ids[i] = self.ids[last]
+        self.ids.pop()
+
+    def nearest(
+        self, vector: np.ndarray, exclude: Optional[str] = None
+    ) -> Tuple[Optional[str], float]:
+        """最近的鄰居；exclude 是查詢的客戶本人，不跟自己比對"""
+        n = len(self.ids)
+        dist = np.linalg.norm(self.vectors[:n] - vector, axis=1)
+        if exclude in self.ids:
+            dist[self.ids.index(exclude)] = np.inf
+        if n == 0 or not np.isfinite(dist).any():
+            return None, float("inf")
+        i = int(np.argmin(dist))
+        return self.ids[i], float(dist[i])
+
+
+class SimilarCustomerCache:
+    """
+    相似客戶快取：特徵幾乎相同的客戶，沿用之前跑過的流失原因與挽留方案。
+
+    - 對 churn_features.csv 的特徵矩陣做標準化（z-score）
+    - 索引依（價值分群, 風險等級）分桶，只有同一桶內的客戶才會互相比對，
+      桶內用 NumPy 一次算完距離；每桶只放「已有 pipeline 結果」的客戶，
+      資料量小，不需要額外的 ANN 套件
+    - insert() 可以隨時新增結果（增量更新索引）
+    - update_vectors()：客戶特徵有異動時更新向量；這位客戶已存的結果是依舊特徵產生的，
+      會從索引移除，不再被別人沿用
+    - lookup() 通過距離與流失機率差距兩道防護才算命中
+    """
+
+    def __init__(
+        self,
+        features: pd.DataFrame,
+        max_distance: float = DEFAULT_MAX_DISTANCE,
+        max_prob_delta: float = DEFAULT_MAX_PROB_DELTA,
+    ):
+        self.feature_cols = list(features.columns)
+        X = features.to_numpy(dtype=float)
+        std = X.std(axis=0)
+        std[std == 0] = 1.0
+        self._mean = X.mean(axis=0)
+        self._std = std
+        self._Z = (X - self._mean) / std
+        self._row_of: Dict[str, int] = {
+            cid: i for i, cid in enumerate(features.index)
+        }
+
+        self.max_distance = max_distance
+        self.max_prob_delta = max_prob_delta
+
+        self._buckets: Dict[Tuple[str, str], _Bucket] = {}
+        self._results: Dict[str, Dict] = {}
+        self._bucket_of: Dict[str, Tuple[str, str]] = {}
+        self._lock = threading.Lock()
+        self._stats = {
+            "lookups": 0,
+            "hits": 0,
+            "misses": 0,
+            "rejected_distance": 0,
+            "rejected_prob_delta": 0,
+            "inserts": 0,
+            "invalidated": 0,
+        }
+        self._hit_distances: List[float] = []
+
+    def _vector(self, customer_id: str) -> Optional[np.ndarray]:
+        # 建立快取之後才新增、且沒有透過 update_vectors() 加入的客戶沒有向量，直接視為查不到
+        with self._lock:
+            row = self._row_of.get(customer_id)
+            return None if row is None else self._Z[row].copy()
+
+    @profiled()
+    def update_vectors(self, customer_ids: List[str], features: pd.DataFrame) -> None:
+        """
+        客戶特徵有異動時（例如增量重新評分）更新向量；標準化沿用建立快取時的平均與標準差。
+        features 的列順序對應 customer_ids。
+        """
+        Z = (features[self.feature_cols].to_numpy(dtype=float) - self._mean) / self._std
+        with self._lock:
+            new_ids = [cid for cid in customer_ids if cid not in self._row_of]
+            if new_ids:
+                n = self._Z.shape[0]
+                self._Z = np.vstack([self._Z, np.zeros((len(new_ids), self._Z.shape[1]))])
+                for i, cid in enumerate(new_ids):
+                    self._row_of[cid] = n + i
+            for cid, z in zip(customer_ids, Z):
+                self._Z[self._row_of[cid]] = z
+                # 舊結果是依舊特徵產生的，不能再當作鄰居被沿用
+                key = self._bucket_of.pop(cid, None)
+                if key is not None:
+                    self._buckets[key].remove(cid)
+                    del self._results[cid]
+                    self._stats["invalidated"] += 1
+
+    @profiled()
+    def insert(self, result: Dict) -> None:
+        """把一筆 run_full_pipeline 的結果放進索引"""
+        customer_id = result["customer_id"]
+        key = (
+            result["campaign"]["value_segment"],
+            risk_level(result["analyst"]["churn_probability"]),
+        )
+        vector = self._vector(customer_id)
+        if vector is None:
+            return
+
+        with self._lock:
+            if customer_id not in self._results:
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    bucket = self._buckets[key] = _Bucket(vector.shape[0])
+                bucket.add(customer_id, vector)
+                self._bucket_of[customer_id] = key
+                self._stats["inserts"] += 1
+            self._results[customer_id] = result
+
+    @profiled()
+    def lookup(
+        self,
+        customer_id: str,
+        value_segment: str,
+        churn_probability: float,
+    ) -> Optional[Dict]:
+        """
+        找同一桶內最近的鄰居（不含這位客戶自己之前的結果）；通過防護時回傳已調整成這位客戶的
+        {"reasoning": ..., "campaign": ..., "reused_from": {...}}，否則回傳 None。
+        """
+        key = (value_segment, risk_level(churn_probability))
+        vector = self._vector(customer_id)
+
+        with self._lock:
+            self._stats["lookups"] += 1
+            bucket = self._buckets.get(key)
+            neighbor_id, distance = (
+                bucket.nearest(vector, exclude=customer_id)
+                if bucket is not None and vector is not None
+                else (None, float("inf"))
+            )
+            if neighbor_id is None:
+                self._stats["misses"] += 1
+                return None
+            if distance > self.max_distance:
+                self._stats["rejected_distance"] += 1
+                return None
+            neighbor = self._results[neighbor_id]
+            prob_delta = abs(
+                neighbor["analyst"]["churn_probability"] - churn_probability
+            )
+            if prob_delta > self.max_prob_delta:
+                self._stats["rejected_prob_delta"] += 1
+                return None
+            self._stats["hits"] += 1
+            self._hit_distances.append(distance)
+
+        reused = adapt_result(neighbor, customer_id)
+        reused["reused_from"] = {
+            "customer_id": neighbor_id,
+            "distance": distance,
+            "prob_delta": prob_delta,
+        }
+        return reused
+
+    def metrics(self) -> Dict:
+        """命中率與品質防護統計"""
+        with self._lock:
+            stats = dict(self._stats)
+            distances = list(self._hit_distances)
+        lookups = stats["lookups"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        stats["mean_hit_distance"] = (
+            float(np.mean(distances)) if distances else None
+        )
+        stats["max_hit_distance"] = max(distances) if distances else None
+        stats["indexed_customers"] = len(self._results)
+        return stats
+
+
+def adapt_result(neighbor_result: Dict, customer_id: str) -> Dict:
+    """
+    把鄰居的流失原因與挽留方案改成目前這位客戶的版本：
+    只替換客戶專屬欄位（customer_id 與文字中出現的客戶編號），其餘沿用。
+    """
+    neighbor_id = neighbor_result["customer_id"]
+    reasoning = dict(neighbor_result["reasoning"])
+    campaign = dict(neighbor_result["campaign"])
+
+    reasoning["customer_id"] = customer_id
+    reasoning["reasoning"] = reasoning.get("reasoning", "").replace(
+        neighbor_id, customer_id
+    )
+    campaign["customer_id"] = customer_id
+    campaign["campaign_plan"] = campaign.get("campaign_plan", "").replace(
+        neighbor_id, customer_id
+    )
+    return {"reasoning": reasoning, "campaign": campaign}
+
+
+@lru_cache(maxsize=1)
+def get_similar_cache() -> SimilarCustomerCache:
+    """整個 process 共用的相似客戶快取，啟動時先放入已儲存的結果"""
+    df = _load_churn_df()
+    feature_cols = _load_feature_cols()
+    cache = SimilarCustomerCache(df.set_index("customerID")[feature_cols])
+
+    for item in get_result_store().query(include_results=True):
+        result = item["result"]
+        # 只拿「真的跑過 LLM」的結果當鄰居，避免沿用再沿用
+        if "reused_from" not in result:
+            cache.insert(result)
+    return cache
@@ -1,5 +1,6 @@
 # src/tools.py
 
+import hashlib
 import json
 from functools import lru_cache
 from pathlib import Path
@@ -8,6 +9,8 @@ from typing import Dict, List
 import joblib
 import pandas as pd
 
+from src.profiling import profiled
+
 
 DATA_PROCESSED_PATH = Path("data/processed/churn_features.csv")
 PROFILE_PATH = Path("data/processed/customer_profiles.csv")
@@ -16,6 +19,7 @@ FEATURE_COLS_PATH = Path("models/feature_columns.json")
 
 
 @lru_cache(maxsize=1)
+@profiled()
 def _load_churn_df() -> pd.DataFrame:
     """載入含有特徵 + 標籤 + customerID 的資料表"""
     if not DATA_PROCESSED_PATH.exists():
@@ -26,6 +30,7 @@ def _load_churn_df() -> pd.DataFrame:
 
 
 @lru_cache(maxsize=1)
+@profiled()
 def _load_profiles_df() -> pd.DataFrame:
     """載入比較原始的客戶 profile（給 LLM 看的）"""
     if not PROFILE_PATH.exists():
@@ -36,6 +41,7 @@ def _load_profiles_df() -> pd.DataFrame:
 
 
 @lru_cache(maxsize=1)
+@profiled()
 def _load_churn_model():
     """載入訓練好的 churn model"""
     if not MODEL_PATH.exists():
@@ -46,6 +52,7 @@ def _load_churn_model():
 
 
 @lru_cache(maxsize=1)
+@profiled()
 def _load_feature_cols() -> List[str]:
     """載入當初訓練時的特徵欄位順序"""
     if not FEATURE_COLS_PATH.exists():
@@ -57,12 +64,24 @@ def _load_feature_cols() -> List[str]:
     return cols
 
 
+@lru_cache(maxsize=1)
+def get_model_version() -> str:
+    """用模型檔內容的 hash 當版本號，重新訓練後就會不同"""
+    if not MODEL_PATH.exists():
+        raise FileNotFoundError(
+            f"找不到 {MODEL_PATH}，請先執行 python -m src.train_churn_model"
+        )
+    return hashlib.sha1(MODEL_PATH.read_bytes()).hexdigest()[:12]
+
+
+@profiled()
 def list_customer_ids() -> List[str]:
     """回傳所有 customerID 清單（給之後 UI 下拉選單用）"""
     df = _load_churn_df()
     return df["customerID"].tolist()
 
 
+@profiled()
 def query_customer_profile(customer_id: str) -> Dict:
     """回傳某個客戶的 profile（原始欄位為主）"""
     profiles = _load_profiles_df()
@@ -72,6 +91,7 @@ def query_customer_profile(customer_id: str) -> Dict:
     return row.iloc[0].to_dict()
 
 
+@profiled()
 def predict_churn(customer_id: str) -> float:
     """
     使用訓練好的模型，對指定 customerID 預測流失機率（回傳 0~1 間的浮點數）
@@ -89,6 +109,16 @@ def predict_churn(customer_id: str) -> float:
     return prob
 
 
+def risk_level(prob: float) -> str:
+    """根據機率給一個簡單的風險等級標籤"""
+    if prob >= 0.7:
+        return "高風險"
+    elif prob >= 0.4:
+        return "中風險"
+    else:
+        return "低風險"
+
+
 def get_random_customer_id() -> str:
     """從資料集中隨機挑一位客戶（之後 demo 可以用）"""
     df = _load_churn_df()